@@ -2,151 +2,731 @@
 
 from __future__ import absolute_import
 
-
+import threading
+import time
+from collections import OrderedDict
 from decimal import Decimal
+from fractions import Fraction
 
 import dicetables as dt
 import numpy as np
 import file_handler as fh
+import freq_math as fm
+import plot_tools as pt
+
+_INFO_REQUESTS = {
+    'range': lambda table: table.values_range(),
+    'mean': lambda table: table.mean(),
+    'stddev': lambda table: table.stddev(),
+    'text': str,
+    'weights_info': lambda table: table.weights_info(),
+    'dice_list': lambda table: table.get_list(),
+    'full_text': dt.full_table_string,
+    'frequencies': lambda table: fm.Frequencies.from_tuple_list(
+        table.frequency_all())
+    }
+
+def _restore_table(frequencies, dice_list):
+    '''makes a dt.DiceTable directly from its fm.Frequencies and its dice list
+    without doing any dice math'''
+    table = dt.DiceTable()
+    table.update_frequency(0, 0)
+    table.merge(frequencies.tuple_list())
+    for die, number in dice_list:
+        table.update_list(number, die)
+    return table
+
+def _running_total(frequencies):
+    '''returns (offset, running total array) of an fm.Frequencies.
+    see fm.running_total'''
+    return frequencies.offset, fm.running_total(frequencies.array)
+
+def _range_string(start, stop):
+    '''the same string dt.stats makes for all ints between and including
+    start and stop'''
+    def paren_negs(num):
+        '''returns str(num) with parentheses around negative numbers'''
+        return '({:,})'.format(num) if num < 0 else '{:,}'.format(num)
+    if start == stop:
+        return paren_negs(start)
+    return '{}-{}'.format(paren_negs(start), paren_negs(stop))
+
+def _fix_tiny_pct(stat_info):
+    '''dt.stats rounds tiny percents to '0.0'. returns stat_info as a tuple
+    with those percents in sci notation'''
+    stat_info = list(stat_info)
+    if stat_info[3] != 'infinity' and stat_info[4] == '0.0':
+        new_pct = str(100/Decimal(stat_info[3])).split('E')
+        stat_info[4] = '{:.3f}e{}'.format(float(new_pct[0]), new_pct[1])
+    return tuple(stat_info)
+
+#the frequencies of every table made or reloaded, shared by all TableManagers
+TABLE_CACHE = fm.FrequencyCache(32 * 2**20)
+
+def _dice_key(dice_list):
+    '''returns a canonical, hashable form of dice_list for TABLE_CACHE. the
+    same die may be in dice_list more than once and numbers may be
+    negative.'''
+    counts = {}
+    for die, number in dice_list:
+        counts[repr(die)] = counts.get(repr(die), 0) + number
+    return tuple(sorted(pair for pair in counts.items() if pair[1]))
+
+#the frequencies of number of one die (nDk building blocks), keyed by
+#(repr(die), number), shared by all TableManagers
+POWER_CACHE = fm.FrequencyCache(16 * 2**20)
+
+def _die_power(die, number, known):
+    '''returns (offset, array) of number of die, or None if neither number nor
+    known number of die are in POWER_CACHE. a new power is made from the
+    known one and cached.'''
+    cached = POWER_CACHE.get((repr(die), number))
+    if cached is not None:
+        return cached
+    if known == 0:
+        start = (0, np.array([1], dtype=np.int64))
+    else:
+        start = POWER_CACHE.get((repr(die), known))
+    if start is None:
+        return None
+    if number > known:
+        offset, array = fm.add_dice(start[0], start[1], die, number - known)
+    else:
+        offset, array = fm.remove_dice(start[0], start[1], die, known - number)
+    POWER_CACHE.put((repr(die), number), offset, array)
+    return offset, array
+
+def _is_big_removal(number, die):
+    '''True if removing -number of die needs a full polynomial division. then
+    it's faster to convolve cached pieces.'''
+    size = len(fm.die_frequencies(die)[1])
+    return -number * (size - 1) + 1 >= fm.LONG_DIVIDE_SIZE
+
+def _rest_of_table(dice_list):
+    '''returns (offset, array) of dice_list from TABLE_CACHE, or by combining
+    their powers in POWER_CACHE. returns None if any are missing.'''
+    if not dice_list:
+        return 0, np.array([1], dtype=np.int64)
+    key = _dice_key(dice_list)
+    if key in TABLE_CACHE:
+        return TABLE_CACHE.get(key)
+    if any((repr(die), number) not in POWER_CACHE
+           for die, number in dice_list):
+        return None
+    offset, array = 0, np.array([1], dtype=np.int64)
+    for die, number in dice_list:
+        power_offset, power = POWER_CACHE.get((repr(die), number))
+        offset, array = offset + power_offset, fm.convolve(array, power)
+    TABLE_CACHE.put(key, offset, array)
+    return offset, array
+
+def _matches_dice(frequencies, dice_list):
+    '''a quick check that an fm.Frequencies could be the frequencies of
+    dice_list. compares the lowest roll, the highest roll and the total
+    frequency.'''
+    low, high, total_freq = 0, 0, 1
+    for die, number in dice_list:
+        die_list = [pair for pair in die.tuple_list() if pair[1]]
+        low += die_list[0][0] * number
+        high += die_list[-1][0] * number
+        total_freq *= sum(freq for _, freq in die_list) ** number
+    return (frequencies.values_range() == (low, high) and
+            frequencies.total() == total_freq)
 
 class TableManager(object):
     '''an object that controls the table'''
     def __init__(self):
         '''just a shell for table'''
         self._table = dt.DiceTable()
+        self._info = {}
+        self._info_hits = {}
+        self._info_misses = {}
+        self._unchecked = False
+    def _invalidate(self):
+        '''clears all info calculated from the table. call at every change.'''
+        self._info = {}
+    def _cached(self, key, function):
+        '''returns self._info[key], calling function() to make it only if it
+        isn't already there. records hits and misses for request_cache_info'''
+        if key in self._info:
+            self._info_hits[key] = self._info_hits.get(key, 0) + 1
+        else:
+            self._info_misses[key] = self._info_misses.get(key, 0) + 1
+            self._info[key] = function()
+        return self._info[key]
     def request_info(self, request):
-        '''returns requested info to child widget'''
-        requests = {'range': [self._table.values_range, ()],
-                    'mean': [self._table.mean, ()],
-                    'stddev': [self._table.stddev, ()],
-                    'text': [str, (self._table,)],
-                    'text_one_line': [str(self._table).replace, ('\n', ' \\ ')],
-                    'weights_info': [self._table.weights_info, ()],
-                    'dice_list': [self._table.get_list, ()],
-                    'full_text': [dt.full_table_string, (self._table,)],
-                    'tuple_list': [self._table.frequency_all, ()]}
-        command, args = requests[request]
-        return command(*args)
+        '''returns requested info to child widget. each value is only
+        calculated once for each state of the table.'''
+        if request == 'text_one_line':
+            value = self._cached(
+                request,
+                lambda: self.request_info('text').replace('\n', ' \\ ')
+                )
+        elif request == 'tuple_list':
+            value = self._cached(
+                request, lambda: self.request_info('frequencies').tuple_list()
+                )
+        else:
+            value = self._cached(
+                request, lambda: _INFO_REQUESTS[request](self._table)
+                )
+        if isinstance(value, list):
+            value = value[:]
+        return value
+    def request_cache_info(self):
+        '''returns a dict of {request: (hits, misses, hit_rate)} for every
+        request_info key that has been asked for.'''
+        out = {}
+        for key in set(self._info_hits) | set(self._info_misses):
+            hits = self._info_hits.get(key, 0)
+            misses = self._info_misses.get(key, 0)
+            out[key] = (hits, misses, hits / float(hits + misses))
+        return out
     def request_stats(self, stat_list):
         '''returns stat info from a list of ints'''
-        stat_info = list(dt.stats(self._table, stat_list))
-        if stat_info[3] != 'infinity' and stat_info[4] == '0.0':
-            new_pct = str(100/Decimal(stat_info[3])).split('E')
-            stat_info[4] = '{:.3f}e{}'.format(float(new_pct[0]), new_pct[1])
-        return tuple(stat_info)
+        return _fix_tiny_pct(dt.stats(self._table, stat_list))
+    def request_stats_range(self, val_1, val_2):
+        '''returns stat info for all ints between and including val_1 and
+        val_2. same output as request_stats, but each call is O(1) from an
+        index of running totals made once per state of the table.'''
+        start, stop = min(val_1, val_2), max(val_1, val_2)
+        offset, running = self._running_total()
+        def below(value):
+            '''total frequency of all rolls less than value'''
+            index = min(len(running) - 1, max(0, value - offset))
+            return int(running[index])
+        total_freq = int(running[-1])
+        lst_freq = below(stop + 1) - below(start)
+        if lst_freq == 0:
+            chance = 'infinity'
+            pct = dt.scinote(0)
+        else:
+            chance = dt.scinote(dt.long_int_div(total_freq, lst_freq))
+            pct = dt.scinote(100 * dt.long_int_div(lst_freq, total_freq))
+        return _fix_tiny_pct((_range_string(start, stop),
+                              dt.scinote(lst_freq), dt.scinote(total_freq),
+                              chance, pct))
+    def _running_total(self):
+        '''returns (offset, running total array) of the table, made once per
+        state of the table. see fm.running_total'''
+        return self._cached(
+            'running_total',
+            lambda: _running_total(self.request_info('frequencies'))
+            )
+    def request_quantiles(self, fractions):
+        '''fractions is a list of numbers from 0 to 1. returns a list of the
+        smallest roll that each fraction of all combinations is at or below.
+        each one is a binary search of the running totals.'''
+        offset, running = self._running_total()
+        total_freq = int(running[-1])
+        targets = []
+        for fraction in fractions:
+            if not 0 <= fraction <= 1:
+                raise ValueError('fractions must be from 0 to 1')
+            fraction = Fraction(fraction)
+            targets.append(
+                -(-fraction.numerator * total_freq // fraction.denominator)
+                )
+        targets = np.array(targets, dtype=running.dtype)
+        indices = np.searchsorted(running, targets)
+        return [offset + max(1, int(index)) - 1 for index in indices]
+    def request_percentiles(self, percents):
+        '''percents is a list of numbers from 0 to 100.
+        see request_quantiles'''
+        fractions = [Fraction(pct) / 100 for pct in percents]
+        return self.request_quantiles(fractions)
+    def request_tail_probabilities(self, values, upper=True):
+        '''returns a list of the chance, from 0 to 1, of rolling at or above
+        each value. if upper=False, the chance of rolling at or below it.'''
+        offset, running = self._running_total()
+        total_freq = int(running[-1])
+        answer = []
+        for value in values:
+            if upper:
+                index = value - offset
+            else:
+                index = value - offset + 1
+            below = int(running[min(len(running) - 1, max(0, index))])
+            part = total_freq - below if upper else below
+            answer.append(float(dt.long_int_div(part, total_freq)))
+        return answer
     def request_plot_obj(self, use_axes):
         '''converts the table into a PlotObject'''
         new_object = {}
+        frequencies = self.request_info('frequencies')
+        percents = _pts_rows(frequencies)[:, 1]
         new_object['text'] = self.request_info('text_one_line')
-        graph_pts = dt.graph_pts(self._table, axes=use_axes, exact=False)
-        new_object['x_range'] = self._table.values_range()
-        if use_axes:
-            y_pts = graph_pts[1]
-        else:
-            y_pts = [pair[1] for pair in graph_pts]
-        new_object['y_range'] = (min(y_pts), max(y_pts))
-        new_object['pts'] = graph_pts
-        new_object['tuple_list'] = self.request_info('tuple_list')
-        new_object['dice'] = self._table.get_list()
+        new_object['x_range'] = self.request_info('range')
+        new_object['y_range'] = (float(percents.min()), float(percents.max()))
+        new_object['pts'] = _graph_pts(frequencies, use_axes)
+        new_object['tuple_list'] = frequencies
+        new_object['dice'] = self.request_info('dice_list')
         return new_object
     def request_reload(self, plot_obj):
-        '''loads plot_obj as the main die table'''
-        self._table = dt.DiceTable()
-        for die, number in plot_obj['dice']:
-            self._table.update_list(number, die)
-        self._table.add(1, plot_obj['tuple_list'])
+        '''loads plot_obj as the main die table. uses TABLE_CACHE if it has
+        those dice. if not, the stored frequencies are used as they are, with
+        no dice math. raises ValueError if they don't match the stored dice.
+        _matches_dice only checks their range and total, so they aren't put
+        in TABLE_CACHE, and neither is any table made from them.'''
+        key = _dice_key(plot_obj['dice'])
+        cached = TABLE_CACHE.get(key)
+        if cached is None:
+            frequencies = fm.Frequencies.from_tuple_list(
+                plot_obj['tuple_list'])
+            if not _matches_dice(frequencies, plot_obj['dice']):
+                raise ValueError('tuple_list does not match dice')
+        else:
+            frequencies = fm.Frequencies(*cached)
+        self._set_table(_restore_table(frequencies, plot_obj['dice']),
+                        frequencies, cached is None)
+    def _set_table(self, table, frequencies, unchecked=False):
+        '''makes table the current table, with its fm.Frequencies already
+        known. unchecked is True if they came from history and not from dice
+        math.'''
+        self._table = table
+        self._invalidate()
+        self._info['frequencies'] = frequencies
+        self._unchecked = unchecked
+    def _change_dice(self, number, die):
+        '''changes the number of die in the table by number (+ or -). looks in
+        TABLE_CACHE first. for big removals, next tries combining the rest of
+        the table with the new power of die from the caches. otherwise it
+        changes the current frequencies. raises ValueError if they can't be
+        divided by the dice.'''
+        dice_list = self.request_info('dice_list') + [(die, number)]
+        key = _dice_key(dice_list)
+        cached = TABLE_CACHE.get(key)
+        unchecked = False
+        if cached is None and _is_big_removal(number, die):
+            cached = self._combine_cached(number, die)
+        if cached is None:
+            cached = self._change_current(number, die)
+            unchecked = self._unchecked
+        if not unchecked:
+            TABLE_CACHE.put(key, *cached)
+        frequencies = fm.Frequencies(*cached)
+        self._set_table(_restore_table(frequencies, dice_list), frequencies,
+                        unchecked)
+    def _change_current(self, number, die):
+        '''returns (offset, freqs) of the current frequencies with number
+        (+ or -) of die added. adds keep the power of die in POWER_CACHE in
+        step with the table. removals don't, since dividing the power costs
+        as much as dividing the table.'''
+        known = self._table.number_of_dice(die)
+        current = self.request_info('frequencies')
+        offset, freqs = current.offset, current.array
+        die_offset, die_array = fm.die_frequencies(die)
+        change_offset, change = fm.power(die_offset, die_array, abs(number))
+        if number > 0:
+            answer = offset + change_offset, fm.convolve(freqs, change)
+        else:
+            answer = offset - change_offset, fm.divide(freqs, change)
+        if known == 0:
+            POWER_CACHE.put((repr(die), number), change_offset, change)
+        elif number > 0 and (repr(die), known) in POWER_CACHE:
+            _die_power(die, known + number, known)
+        return answer
+    def _combine_cached(self, number, die):
+        '''returns (offset, freqs) of the table with number (+ or -) of die
+        added, made from cached pieces. None if they aren't there.'''
+        known = self._table.number_of_dice(die)
+        rest = _rest_of_table([(other, count) for other, count
+                               in self.request_info('dice_list')
+                               if other != die])
+        if rest is None or known + number == 0:
+            return rest
+        power = _die_power(die, known + number, known)
+        if power is None:
+            return None
+        return rest[0] + power[0], fm.convolve(rest[1], power[1])
     def request_add(self, number, die):
         '''adds dice to table. number is int>=0. die is child of dt.ProtoDie'''
-        self._table.add_die(number, die)
+        if number < 0:
+            raise ValueError('number must be a positive int')
+        if number:
+            self._change_dice(number, die)
     def request_remove(self, number, die):
         '''safely removes dice from table. if too many removed, removes all of
         that kind of dice. number is int>=0. die is child of dt.ProtoDie.'''
-        current = self._table.number_of_dice(die)
-        if number > current:
-            self._table.remove_die(current, die)
-        else:
-            self._table.remove_die(number, die)
+        number = min(number, self._table.number_of_dice(die))
+        if number > 0:
+            try:
+                self._change_dice(-number, die)
+            except ValueError:
+                self._table.remove_die(number, die)
+                self._invalidate()
     def request_reset(self):
         '''reset dice table'''
         self._table = dt.DiceTable()
+        self._invalidate()
+        self._unchecked = False
+
+def _history_key(text, tuple_list):
+    '''returns the (text, digest) key of a plot object in HistoryManager.
+    tuple_list is an fm.Frequencies or a legacy tuple_list. returns None if
+    it is neither.'''
+    try:
+        frequencies = fm.Frequencies.from_tuple_list(tuple_list)
+    except (ValueError, TypeError):
+        return None
+    return text, frequencies.digest()
+
+PTS_CACHE = fm.FrequencyCache(8 * 2**20)
+
+def _pts_rows(frequencies):
+    '''returns a read-only array of [roll, percent] rows of an fm.Frequencies,
+    see fm.percents. it is kept in PTS_CACHE, which throws out the least
+    recently used when it's full.'''
+    cached = PTS_CACHE.get(frequencies.digest())
+    if cached is None:
+        percents = fm.percents(frequencies.array)
+        rows = np.column_stack(
+            (np.arange(frequencies.offset, frequencies.offset + len(percents)),
+             percents))
+        rows.flags.writeable = False
+        cached = frequencies.offset, rows
+        PTS_CACHE.put(frequencies.digest(), *cached)
+    return cached[1]
+
+def _graph_pts(tuple_list, use_axes):
+    '''makes the pts of a plot object from its tuple_list. with use_axes,
+    they are [x array, y array], and otherwise an array of [x, y] rows. they
+    are read-only views of _pts_rows, so no points are copied.'''
+    rows = _pts_rows(fm.Frequencies.from_tuple_list(tuple_list))
+    if use_axes:
+        return [rows[:, 0], rows[:, 1]]
+    return rows
+
+PYRAMID_CACHE = pt.PyramidCache(8 * 2**20)
+
+def _detail_pyramid(frequencies):
+    '''returns the pt.DetailPyramid of the pts of an fm.Frequencies. it is
+    kept in PYRAMID_CACHE, so it is only made once for each plot object.'''
+    pyramid = PYRAMID_CACHE.get(frequencies.digest())
+    if pyramid is None:
+        rows = _pts_rows(frequencies)
+        pyramid = pt.DetailPyramid(rows[:, 0], rows[:, 1])
+        PYRAMID_CACHE.put(frequencies.digest(), pyramid)
+    return pyramid
+
+_NO_RANGES = ((float('inf'), float('-inf')), (float('inf'), float('-inf')))
+
+def _join_ranges(ranges, plot_obj):
+    '''(x_range, y_range) that covers ranges and plot_obj's ranges'''
+    (x_min, x_max), (y_min, y_max) = ranges
+    return ((min(x_min, plot_obj['x_range'][0]),
+             max(x_max, plot_obj['x_range'][1])),
+            (min(y_min, plot_obj['y_range'][0]),
+             max(y_max, plot_obj['y_range'][1])))
 
 class HistoryManager(object):
-    '''keeps track of plot history and writing'''
-    def __init__(self):
-        self._history = np.array([], dtype=object)
+    '''keeps track of plot history and writing. plot objects are kept in order
+    in an OrderedDict keyed by (text, digest of tuple_list), so adding, finding
+    and removing are O(1). changes are written to a journal, and the whole
+    history is written as a columnar file (see fh.write_history_np) once the
+    journal has compact_after records. if write_delay is a number of seconds,
+    writes happen in a background thread that waits write_delay for more
+    changes and writes them all at once. compress is passed to
+    fh.write_history_np. plot objects are kept without pts (see
+    fh.without_pts), and their pts are made again when they are asked for. the
+    x and y ranges of the whole history are kept up to date as plot objects are
+    added, and found again only after some are removed.'''
+    def __init__(self, compact_after=50, write_delay=None, compress=None):
+        self._history = OrderedDict()
+        self._loaders = {}
+        self._ranges = _NO_RANGES
+        self.compact_after = compact_after
+        self.compress = compress
+        self._pending = []
+        self._in_flight = 0
+        self._error = None
+        self._journal_size = 0
+        self._synced = False
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._write_delay = write_delay
+        self._wake = threading.Event()
+        if write_delay is not None:
+            writer = threading.Thread(target=self._write_loop)
+            writer.daemon = True
+            writer.start()
 
+    def _load(self, entries):
+        '''replaces the history with (text, fm.Frequencies, load) entries from
+        fh.read_history_index. until load is called, an entry only has its
+        text and tuple_list.'''
+        history = OrderedDict()
+        loaders = {}
+        for text, frequencies, load in entries:
+            key = _history_key(text, frequencies)
+            history[key] = {'text': text, 'tuple_list': frequencies}
+            loaders[key] = load
+        self._history = history
+        self._loaders = loaders
+        self._ranges = None
+    def _full_obj(self, key):
+        '''returns the plot object at key, loading it if needed. an entry that
+        fails to load is removed, and the next write is a compact one.
+        returns None if there is no plot object.'''
+        with self._lock:
+            obj = self._history.get(key)
+            load = self._loaders.pop(key, None)
+            if load is None:
+                return obj
+            try:
+                obj = load()
+            except ValueError:
+                del self._history[key]
+                self._synced = False
+                self._ranges = None
+                return None
+            self._history[key] = obj
+            return obj
     def add_plot_obj(self, new_obj):
         '''adds a new plot obj. will not add empty table or duplicates'''
         def not_empty_obj(obj):
             '''returns bool. tests if plot_object is empty'''
             return bool(obj['text']) and obj['tuple_list'] != [(0, 1)]
-        if new_obj not in self._history and not_empty_obj(new_obj):
-            self._history = np.append(self._history, new_obj)
+        key = _history_key(new_obj['text'], new_obj['tuple_list'])
+        with self._lock:
+            if key not in self._history and not_empty_obj(new_obj):
+                new_obj = fh.without_pts(new_obj)
+                self._history[key] = new_obj
+                self._pending.append(('add', new_obj))
+                if self._ranges is not None:
+                    self._ranges = _join_ranges(self._ranges, new_obj)
     def get_obj(self, text, tuple_list):
         '''checks to see if any of the objects in history have tuple_list and
-        text. returns that object or if not there, returns empty dict.'''
+        text. returns that object or if not there, returns empty dict. its
+        pts are read-only views, see _graph_pts.'''
         new_plot_obj = {}
-        for plot_obj in self._history:
-            if (text == plot_obj['text'] and
-                    tuple_list == plot_obj['tuple_list']):
-                for key, val in plot_obj.items():
-                    if isinstance(val, list):
-                        val = val[:]
-                    new_plot_obj[key] = val
+        plot_obj = self._full_obj(_history_key(text, tuple_list))
+        if plot_obj is not None:
+            for key, val in plot_obj.items():
+                if isinstance(val, list):
+                    val = val[:]
+                new_plot_obj[key] = val
+            new_plot_obj['pts'] = _graph_pts(new_plot_obj['tuple_list'],
+                                             new_plot_obj.pop('axes'))
         return new_plot_obj
     def get_labels(self):
         '''returns a list of tuples (plot_obj['text'], plot_obj['tuple_list'])
         for each plot_obj in history'''
         labels = []
-        for obj in self._history:
-            labels.append((obj['text'], obj['tuple_list'][:]))
+        for obj in list(self._history.values()):
+            labels.append((obj['text'], obj['tuple_list']))
         return labels
     def get_graphs(self):
         '''returns ((x_range of history), (y_range of history),
                     [(graph_text, [graph_values]), -> for each obj in history])
+        the graph_values are read-only views, see _graph_pts.
         '''
         out = []
-        x_range = y_range = (float('inf'), float('-inf'))
-        for obj in self._history:
-            x_range = (min(x_range[0], obj['x_range'][0]),
-                       max(x_range[1], obj['x_range'][1]))
-            y_range = (min(y_range[0], obj['y_range'][0]),
-                       max(y_range[1], obj['y_range'][1]))
-            out.append((obj['text'], obj['pts'][:]))
+        with self._lock:
+            objs = [self._full_obj(key) for key in list(self._history.keys())]
+            objs = [obj for obj in objs if obj is not None]
+            if self._ranges is None:
+                ranges = _NO_RANGES
+                for obj in objs:
+                    ranges = _join_ranges(ranges, obj)
+                self._ranges = ranges
+            x_range, y_range = self._ranges
+        for obj in objs:
+            out.append((obj['text'],
+                        _graph_pts(obj['tuple_list'], obj['axes'])))
         return (x_range, y_range, out)
     def clear_all(self):
         '''clear graph history'''
-        self._history = np.array([], dtype=object)
+        with self._lock:
+            self._history = OrderedDict()
+            self._loaders = {}
+            self._ranges = _NO_RANGES
+            self._pending = [('clear', None)]
     def clear_selected(self, obj_list):
         '''clear listed items from graph history. obj_list is a list of plot
-        objects'''
-        new_history = []
-        for obj in self._history:
-            if obj not in obj_list:
-                new_history.append(obj)
-        self._history = np.array(new_history[:], dtype=object)
+        objects, or of dicts with only their text and tuple_list. entries that
+        aren't loaded yet are removed without loading them. returns how many
+        were removed.'''
+        removed = 0
+        with self._lock:
+            for obj in obj_list:
+                key = _history_key(obj.get('text'), obj.get('tuple_list'))
+                self._loaders.pop(key, None)
+                if self._history.pop(key, None) is not None:
+                    self._pending.append(('remove', key))
+                    self._ranges = None
+                    removed += 1
+        return removed
+    def _replay(self, records):
+        '''applies journal records to the history'''
+        for action, value in records:
+            if action == 'add' and fh.check_data(value) == 'ok':
+                value = fh.without_pts(value)
+                value['tuple_list'] = fm.Frequencies.from_tuple_list(
+                    value['tuple_list'])
+                self._history.setdefault(
+                    _history_key(value['text'], value['tuple_list']), value)
+            elif action == 'remove':
+                self._history.pop(tuple(value), None)
+                self._loaders.pop(tuple(value), None)
+            elif action == 'clear':
+                self._history = OrderedDict()
+                self._loaders = {}
+    def compact_history(self):
+        '''writes the whole history as a new columnar file, which replaces
+        the old one, and empties the journal. see fh.write_history_np'''
+        with self._write_lock:
+            with self._lock:
+                records = self._pending
+                self._in_flight = len(records) + 1
+                self._pending = []
+                self._synced = True
+            self._write(True, records)
+    def _write(self, compact, records):
+        '''call with self._write_lock, after counting records and the compact
+        in self._in_flight. writes the whole history if compact, or else
+        appends records to the journal. if writing fails for any reason, the
+        records are pending again, the error is kept for write_error and the
+        next write is a compact one, so no change is lost.'''
+        try:
+            if compact:
+                for key in list(self._history.keys()):
+                    self._full_obj(key)
+                with self._lock:
+                    history = np.empty(len(self._history), dtype=object)
+                    for position, obj in enumerate(self._history.values()):
+                        history[position] = obj
+                fh.write_history_np(history, self.compress)
+            else:
+                fh.append_journal(records)
+        except Exception as error:
+            with self._lock:
+                self._pending = list(records) + self._pending
+                self._in_flight = 0
+                self._synced = False
+                self._error = error
+            raise
+        with self._lock:
+            self._in_flight = 0
+            self._error = None
+            if compact:
+                self._journal_size = 0
+            else:
+                self._journal_size += len(records)
+    def _write_now(self):
+        '''writes the changes since the last write to the journal. compacts
+        instead if the journal would be too long, after a clear_all, or if
+        this history never read or wrote the file.'''
+        with self._write_lock:
+            with self._lock:
+                records = self._pending
+                size = self._journal_size + len(records)
+                compact = (not self._synced or size > self.compact_after or
+                           ('clear', None) in records)
+                self._in_flight = len(records) + compact
+                self._pending = []
+                self._synced = True
+            if compact or records:
+                self._write(compact, records)
+    def _write_loop(self):
+        '''the background writer. waits for write_history, then waits
+        write_delay for more changes and writes them together.'''
+        while True:
+            self._wake.wait()
+            time.sleep(self._write_delay)
+            self._wake.clear()
+            try:
+                self._write_now()
+            except Exception:  # pylint: disable=broad-except
+                #_write kept the changes pending and the error for
+                #write_error. the writer has to keep running for the
+                #changes still to come.
+                pass
     def write_history(self):
-        '''overwrites graph history to 'numpy_history.npy' '''
-        fh.write_history_np(self._history)
+        '''writes the changes since the last write. see _write_now. with a
+        background writer, this only wakes the writer and returns at once.'''
+        if self._write_delay is None:
+            self._write_now()
+        else:
+            self._wake.set()
+    def flush(self):
+        '''writes all pending changes now, in this thread. call before the
+        app pauses or stops. raises the error if they can't be written, and
+        they stay pending.'''
+        self._write_now()
+    def pending_writes(self):
+        '''returns the number of changes not yet safely on disk'''
+        with self._lock:
+            return len(self._pending) + self._in_flight
+    def write_error(self):
+        '''returns the error of the last write if it failed, else None'''
+        with self._lock:
+            return self._error
     def read_history(self):
-        '''reads from 'numpy_history.npy' and checks for errors. returns a msg
-        that is either "ok" or begins with "error" '''
-        msg, self._history = fh.read_history_np()
+        '''reads the labels from 'numpy_history.npy' and replays the journal.
+        the rest of each plot object is read and checked when it is first
+        graphed or reloaded. returns a msg that is either "ok" or begins with
+        "error". a journal that ends in a record cut off by a crash is cut
+        back to the records before it, or if that fails, the next write is a
+        compact one, so later records aren't lost behind it.'''
+        with self._write_lock:
+            msg, history = fh.read_history_index()
+            try:
+                records = fh.read_journal(repair=True)
+                repaired = True
+            except (IOError, OSError):
+                records = fh.read_journal()
+                repaired = False
+            with self._lock:
+                self._load(history)
+                self._replay(records)
+                self._pending = []
+                self._journal_size = len(records)
+                self._synced = repaired
+        if records and msg == 'error: no file':
+            msg = 'ok'
         return msg
 
 class GraphBox(object):
     '''manages graphing and history'''
-    def __init__(self, table_manager, history_manager, use_axes):
+    def __init__(self, table_manager, history_manager, use_axes,
+                 max_points=pt.MAX_POINTS):
         '''history is a HistoryManager, table_manager is a TableManager.
         use_axes is a boolean - True if the graph uses axes. False if the graph
-        uses pts.'''
+        uses pts. graphs from graph_it have at most max_points points (see
+        pt.downsample), or all of them if max_points is None. it's also the
+        number of points to plot of each graph from graph_pyramids.'''
         self._history = history_manager
         self._table = table_manager
         self.use_axes = use_axes
+        self.max_points = max_points
     def graph_it(self, text_tuple_list_lst):
         '''gets passed a list of tuples containing (text, tuple_list).
         text=str of table, tuple_list=[(roll=int, val=int), ...]
         returns ( (x_range), (y_range), [(text, [graphing_values])...] )'''
+        x_range, y_range, graphs = self._to_graph(
+            text_tuple_list_lst).get_graphs()
+        return (x_range, y_range,
+                [(text, pt.downsample_pts(pts, self.max_points, self.use_axes))
+                 for text, pts in graphs])
+    def graph_pyramids(self, text_tuple_list_lst):
+        '''the same as graph_it, but with every point of each graph in a
+        pt.DetailPyramid. the ranges come from the pyramids, so no pts are
+        made. plot about max_points of each, see pt.DetailPyramid.points.
+        returns ( (x_range), (y_range), [(text, pt.DetailPyramid)...] )'''
+        temp = self._to_graph(text_tuple_list_lst)
+        graphs = [(text, _detail_pyramid(
+            fm.Frequencies.from_tuple_list(tuple_list)))
+                  for text, tuple_list in temp.get_labels()]
+        (x_min, x_max), (y_min, y_max) = _NO_RANGES
+        for _, pyramid in graphs:
+            (x_low, x_high), (y_low, y_high) = pyramid.ranges()
+            x_min, x_max = min(x_min, int(x_low)), max(x_max, int(x_high))
+            y_min, y_max = min(y_min, y_low), max(y_max, y_high)
+        return (x_min, x_max), (y_min, y_max), graphs
+    def _to_graph(self, text_tuple_list_lst):
+        '''a HistoryManager of the plot objects to graph. any that aren't in
+        the history are made from the table and added to it.'''
         #history manager has built-in measures for duplicates and empties
         temp = HistoryManager()
         for text, tuple_list  in text_tuple_list_lst:
@@ -156,19 +736,15 @@ class GraphBox(object):
                 self._history.add_plot_obj(to_plot)
                 self._history.write_history()
             temp.add_plot_obj(to_plot)
-        return temp.get_graphs()
+        return temp
     def clear_selected(self, text_tuple_list_lst):
         '''gets passed a list of tuples containing 'tuple_list' and txt.
         'tuple_list' is the 'tuple_list' key in a plot object or a
         tuple_list of a table. clears the objects from history and writes
         the history'''
-        remove = []
-        for text, tuple_list in text_tuple_list_lst:
-            to_rm = self._history.get_obj(text, tuple_list)
-            if to_rm:
-                remove.append(to_rm)
-        if remove:
-            self._history.clear_selected(remove)
+        remove = [{'text': text, 'tuple_list': tuple_list}
+                  for text, tuple_list in text_tuple_list_lst]
+        if self._history.clear_selected(remove):
             self._history.write_history()
     def clear_all(self):
         '''clears the history'''
@@ -178,13 +754,16 @@ class GraphBox(object):
         '''returns a tuple for a display output.
         (table_manager_text_and_tuple_list, history_manager.get_labels())'''
         current = (self._table.request_info('text_one_line'),
-                   self._table.request_info('tuple_list'))
+                   self._table.request_info('frequencies'))
         return current, self._history.get_labels()
     def reload(self, text, tuple_list):
         '''takes a text, tuple_list and reloads that to table_manager'''
         plot_obj = self._history.get_obj(text, tuple_list)
         if plot_obj:
-            self._table.request_reload(plot_obj)
+            try:
+                self._table.request_reload(plot_obj)
+            except ValueError:
+                pass
 
 
 def get_add_rm(die, number, enable_remove):
@@ -317,6 +896,8 @@ class AddBox(object):
         self._update_die()
 
 
+PERCENTILES = (5, 25, 50, 75, 95)
+
 class StatBox(object):
     '''gets stats for table and displays.'''
     def __init__(self, table_manager):
@@ -345,13 +926,34 @@ class StatBox(object):
         val_1 = min(val_max, max(val_min, val_1))
         val_2 = min(val_max, max(val_min, val_2))
 
-        stat_list = list(range(min(val_1, val_2), max(val_1, val_2) + 1))
-        stat_info = self._table.request_stats(stat_list)
+        stat_info = self._table.request_stats_range(val_1, val_2)
         stat_text = ('\n    {stat[0]} occurred {stat[1]} times\n'+
                      '    out of {stat[2]} total combinations\n\n'+
                      '    that\'s a one in {stat[3]} chance\n'+
                      '    or {stat[4]} percent')
         return [stat_text.format(stat=stat_info), (val_1, val_2)]
+    def display_percentiles(self, val_1, val_2, percents=PERCENTILES):
+        '''val_1 and val_2 are ints. returns a list
+        [text showing the roll at each of percents and the chance of rolling
+         outside of vals, (new_val_1, new_val_2)]'''
+        val_min, val_max = self._table.request_info('range')
+
+        val_1 = min(val_max, max(val_min, val_1))
+        val_2 = min(val_max, max(val_min, val_2))
+
+        rolls = self._table.request_percentiles(percents)
+        lines = ['\n']
+        for pct, roll in zip(percents, rolls):
+            lines.append('    {}% or more of rolls are {:,} or less\n'.format(
+                pct, roll))
+        low, high = min(val_1, val_2), max(val_1, val_2)
+        below = self._table.request_tail_probabilities([low], upper=False)[0]
+        above = self._table.request_tail_probabilities([high])[0]
+        lines.append('\n    {:,} or less: {} percent\n'.format(
+            low, dt.scinote(100 * below)))
+        lines.append('    {:,} or more: {} percent'.format(
+            high, dt.scinote(100 * above)))
+        return [''.join(lines), (val_1, val_2)]
 
 class InfoBox(object):
     '''displays long info about object. can also display long info as page
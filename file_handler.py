@@ -1,22 +1,46 @@
 '''for sending and retrieving main info to file'''
 
+import ast
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import OrderedDict
 #numpy python2 uses cPickle and numpy in python3 uses pickle
 from sys import version_info
 if version_info[0] > 2:
+    import pickle
     from pickle import UnpicklingError
 else:
+    import cPickle as pickle
     from cPickle import UnpicklingError
 
+try:
+    import lzma
+except ImportError:
+    #python2 has no lzma. zlib is always there
+    lzma = None
+
 import dicetables as dt
 import numpy as np
+import freq_math as fm
 
 def _check_dictionary(plot_obj):
     '''checks to make sure that plot object is a dictionary with all appropriate
-    keys. returns 'error: <details>' or 'ok'.'''
+    keys. a plot object from without_pts has 'axes' instead of 'pts'. returns
+    'error: <details>' or 'ok'.'''
     expected = {'y_range':tuple, 'x_range': tuple, 'text':str,
-                'tuple_list':list, 'pts':list, 'dice':list}
+                'tuple_list':(list, fm.Frequencies), 'pts':list, 'dice':list}
     if not isinstance(plot_obj, dict):
         return 'error: not a dict'
+    if 'pts' not in plot_obj and 'axes' in plot_obj:
+        del expected['pts']
+        expected['axes'] = bool
+    elif isinstance(plot_obj.get('pts'), np.ndarray):
+        #numpy pts are an array of [x, y] rows, or a list of two arrays
+        expected['pts'] = np.ndarray
     try:
         for key, val_type in expected.items():
             if not isinstance(plot_obj[key], val_type):
@@ -24,36 +48,66 @@ def _check_dictionary(plot_obj):
         return 'ok'
     except KeyError:
         return 'error: missing key'
+try:
+    _INTEGERS = (int, long)
+except NameError:
+    _INTEGERS = (int,)
+
+def _only_types(values, types):
+    '''checks every element of a numpy object array is one of types. the
+    element types are collected in one pass, not tested one by one.'''
+    return all(issubclass(type_, types)
+               for type_ in set(map(type, values.ravel().tolist())))
+
+def _is_int_array(values):
+    '''checks a numpy array only has ints'''
+    if values.dtype == np.dtype('O'):
+        return _only_types(values, _INTEGERS)
+    return values.dtype.kind in 'iu'
+
+def _as_rows(values):
+    '''makes a list of equal length tuples into a 2-d numpy array. returns
+    None if it can't. an empty list is an empty array.'''
+    try:
+        array = np.array(values)
+    except (ValueError, TypeError):
+        return None
+    if array.size and array.ndim != 2:
+        return None
+    return array
+
 def _check_values(plot_obj):
-    '''checks all the values are the right kinds.  returns 'error:<details>'
-    or 'ok'.'''
-    msg = 'error:'
+    '''checks all the values are the right kinds, with numpy checks of whole
+    arrays. stops at the first error. returns 'error: <details>' or 'ok'.'''
     x_min, x_max = plot_obj['x_range']
     y_min, y_max = plot_obj['y_range']
-    def is_long(num):
-        '''workaround so python2 tests ints and longs and python3 tests ints'''
-        try:
-            return isinstance(num, (int, long))
-        except NameError:
-            return isinstance(num, int)
-
-    if not is_long(x_min) or not is_long(x_max):
-        msg += ' incorrect x_range'
+    if not isinstance(x_min, _INTEGERS) or not isinstance(x_max, _INTEGERS):
+        return 'error: incorrect x_range'
     if not isinstance(y_min, float) or not isinstance(y_max, float):
-        msg += ' incorrect y_range'
-    for freq, val in plot_obj['tuple_list']:
-        if not is_long(freq) or not is_long(val):
-            msg += ' corrupted "tuple_list"'
-    for tuple_ in plot_obj['pts']:
-        for val in tuple_:
-            if not isinstance(val, (int, float)):
-                msg += ' corrupted "pts"'
+        return 'error: incorrect y_range'
+    tuple_list = plot_obj['tuple_list']
+    if isinstance(tuple_list, fm.Frequencies):
+        freqs_ok = (isinstance(tuple_list.offset, _INTEGERS) and
+                    _is_int_array(tuple_list.array))
+    else:
+        pairs = _as_rows(tuple_list)
+        freqs_ok = pairs is not None and (
+            not pairs.size or (pairs.shape[1] == 2 and _is_int_array(pairs)))
+    if not freqs_ok:
+        return 'error: corrupted "tuple_list"'
+    pts = _as_rows(plot_obj.get('pts', []))
+    if pts is None:
+        pts_ok = False
+    elif pts.dtype == np.dtype('O'):
+        pts_ok = _only_types(pts, (int, float))
+    else:
+        pts_ok = not pts.size or pts.dtype.kind in 'biuf'
+    if not pts_ok:
+        return 'error: corrupted "pts"'
     for die, num in plot_obj['dice']:
         if not isinstance(die, dt.ProtoDie) or not isinstance(num, int):
-            msg += ' dicelist at ({!r}, {})'.format(die, num)
-    if msg == 'error:':
-        msg = 'ok'
-    return msg
+            return 'error: dicelist at ({!r}, {})'.format(die, num)
+    return 'ok'
 def check_data(plot_obj):
     '''checks history to see if plot_obj has expected data.  if ok, returns 'ok'
     else returns a msg starting with 'error:' '''
@@ -66,25 +120,579 @@ def check_history(history):
     '''checks a history(a non-empty iterable containing plot_objects. to make
     sure it has the correct kind of data. if ok, returns 'ok' else returns a msg
     starting with 'error' '''
+    msg = 'ok'
     for plot_obj in history:
         msg = check_data(plot_obj)
         if 'error:' in msg:
             break
     return msg
 
-def write_history_np(history):
-    '''takes a numpy array and writes it'''
-    np.save('numpy_history', history)
+def without_pts(plot_obj):
+    '''returns a copy of a plot object without 'pts', which can be made again
+    from 'tuple_list'. instead, 'axes' is True if pts were
+    [(x, x, ...), (y, y, ...)] and False if they were [(x, y), ...].'''
+    new_obj = dict((key, val) for key, val in plot_obj.items() if key != 'pts')
+    if 'axes' not in new_obj:
+        new_obj['axes'] = _is_axes(plot_obj['pts'])
+    return new_obj
+
+def _use_frequencies(history):
+    '''changes a checked history to the form it is kept in: tuple_list is an
+    fm.Frequencies and there are no pts. see without_pts'''
+    for index, plot_obj in enumerate(history):
+        plot_obj = without_pts(plot_obj)
+        plot_obj['tuple_list'] = fm.Frequencies.from_tuple_list(
+            plot_obj['tuple_list'])
+        history[index] = plot_obj
+
+HISTORY_FILE = 'numpy_history.npy'
+JOURNAL_FILE = 'numpy_history.journal'
+
+#the history file is columnar: every plot object's frequencies, pts and so on
+#are put end to end in one array each, so the file can be memory mapped and
+#nothing is unpickled. files from before this start with b'\x93NUMPY' and are
+#still read. version 2 added the digest of each entry's frequencies, so the
+#history can be listed without reading them. version 3 added a crc32 of each
+#entry, so an entry that matches it was checked when it was written and isn't
+#checked again. version 4 can compress some columns. version 5 leaves out pts,
+#which are made from the frequencies. older versions are still read.
+HISTORY_MAGIC = b'DTHIST'
+HISTORY_VERSION = 5
+_PREFIX = struct.Struct('<6sHI')
+_ALIGN = 64
+_DICE_CLASSES = dict((die_class.__name__, die_class) for die_class in
+                     (dt.Die, dt.ModDie, dt.WeightedDie, dt.ModWeightedDie,
+                      dt.StrongDie))
+
+def _is_axes(pts):
+    '''pts are [(x, y), ...] or, from graph_pts(axes=True),
+    [(x, x, ...), (y, y, ...)]. the y values are floats. numpy pts are an
+    array of [x, y] rows or [x array, y array].'''
+    if isinstance(pts, np.ndarray):
+        return False
+    if len(pts) == 2 and isinstance(pts[0], np.ndarray):
+        return True
+    if len(pts) != 2:
+        return False
+    if len(pts[0]) != 2:
+        return True
+    return not isinstance(pts[0][1], float)
+
+def _dice_spec(dice):
+    '''the text of a dice list. dice reprs show everything about a die'''
+    return repr([(die, number) for die, number in dice])
+
+def _from_node(node):
+    '''makes the value of a node of a parsed dice spec. only dice classes,
+    lists, tuples and literals are allowed.'''
+    if isinstance(node, ast.Call):
+        name = getattr(node.func, 'id', None)
+        if name not in _DICE_CLASSES or node.keywords:
+            raise ValueError('not a die: {}'.format(name))
+        return _DICE_CLASSES[name](*[_from_node(arg) for arg in node.args])
+    if isinstance(node, ast.List):
+        return [_from_node(elt) for elt in node.elts]
+    if isinstance(node, ast.Tuple):
+        return tuple(_from_node(elt) for elt in node.elts)
+    return ast.literal_eval(node)
+
+def _dice_from_spec(spec):
+    '''the dice list from its text. see _dice_spec'''
+    return _from_node(ast.parse(spec, mode='eval').body)
+
+def _to_str(data):
+    '''bytes from the file as a str'''
+    if isinstance(data, str):
+        return data
+    return data.decode('utf-8')
+
+_ENTRY_ROWS = ('offsets', 'pts_axes', 'x_range', 'y_range')
+_ENTRY_SLICES = (('freqs', 'freq_bounds'), ('pts', 'pts_bounds'),
+                 ('text', 'text_bounds'), ('dice', 'dice_bounds'),
+                 ('big', 'big_bounds'), ('digest', 'digest_bounds'))
+
+def _entry_checksum(columns, index):
+    '''the crc32 of all the bytes of one entry in the columns'''
+    checksum = 0
+    for name in _ENTRY_ROWS:
+        checksum = zlib.crc32(columns[name][index].tobytes(), checksum)
+    for name, bounds_name in _ENTRY_SLICES:
+        if bounds_name not in columns:
+            continue
+        start, stop = columns[bounds_name][index:index + 2].tolist()
+        checksum = zlib.crc32(columns[name][start:stop].tobytes(), checksum)
+    return checksum & 0xffffffff
+
+def _varint_encode(values):
+    '''encodes a uint64 array as varints: 7 bits a byte, low bits first,
+    with the high bit set on every byte but the last of a value'''
+    sizes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        sizes += values >= np.uint64(1 << shift)
+    starts = np.cumsum(sizes) - sizes
+    places = np.arange(int(sizes.sum())) - np.repeat(starts, sizes)
+    data = (np.repeat(values, sizes) >> (7 * places).astype(np.uint64))
+    data = (data & np.uint64(0x7f)).astype(np.uint8)
+    data[places < np.repeat(sizes, sizes) - 1] |= 0x80
+    return data
+
+def _varint_decode(data):
+    '''decodes a uint8 array of varints to a uint64 array. see
+    _varint_encode'''
+    if not data.size:
+        return np.zeros(0, dtype=np.uint64)
+    ends = data < 0x80
+    if not ends[-1]:
+        raise ValueError('varints are cut off')
+    starts = np.concatenate(([0], np.nonzero(ends)[0][:-1] + 1))
+    value_index = np.concatenate(([0], np.cumsum(ends[:-1])))
+    places = np.arange(len(data)) - starts[value_index]
+    if places.max() > 9:
+        raise ValueError('varint is too long')
+    parts = (data & 0x7f).astype(np.uint64) << (7 * places).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+def _delta_encode(column, previous=0):
+    '''an int64 column as zigzag varints of the differences of its values.
+    neighbouring frequencies are close, so most differences are small.
+    previous is the value before the column, so a column can be encoded in
+    pieces.'''
+    deltas = column.astype(np.int64)
+    deltas[1:] -= column[:-1]
+    if deltas.size:
+        deltas[0] -= previous
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+    return _varint_encode(zigzag.view(np.uint64)).tobytes()
+
+def _delta_decode(data):
+    '''the int64 column of _delta_encode'''
+    zigzag = _varint_decode(np.frombuffer(data, dtype=np.uint8))
+    deltas = (zigzag >> np.uint64(1)).view(np.int64) ^ -(
+        zigzag & np.uint64(1)).view(np.int64)
+    return np.cumsum(deltas)
+
+#compress name: (makes a compressor object, decompress)
+_COMPRESSORS = {'zlib': (zlib.compressobj, zlib.decompress)}
+if lzma is not None:
+    _COMPRESSORS['lzma'] = (lzma.LZMACompressor, lzma.decompress)
+#the columns that are compressed if write_history_np is asked to. the columns
+#needed to list the history stay as they are, so listing stays fast.
+_COMPRESSED = ('freqs', 'dice', 'big')
+
+def _decode(encoding, data, dtype, shape):
+    '''makes the column of _encode'''
+    delta, _, compress = encoding.rpartition('+')
+    data = _COMPRESSORS[compress][1](data)
+    if delta:
+        column = _delta_decode(data).astype(dtype)
+    else:
+        column = np.frombuffer(data, dtype=dtype)
+    column = column.reshape(shape)
+    column.flags.writeable = False
+    return column
+
+class _Columns(object):
+    '''the columns of a history file: read-only views of the memory map, or
+    for encoded columns, arrays decoded the first time they're used'''
+    def __init__(self, data, header):
+        self._data = data
+        self._header = header
+        self._columns = {}
+    def __contains__(self, name):
+        return name in self._header['sections']
+    def get(self, name):
+        '''the column, or None'''
+        if name not in self:
+            return None
+        return self[name]
+    def rows(self, name):
+        '''the length of a column, without decoding it'''
+        return self._header['sections'][name][2][0]
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = self._column(self._header['sections'][name])
+        return self._columns[name]
+    def _column(self, section):
+        '''makes the column of a section of the header'''
+        position, dtype, shape = section[:3]
+        dtype = np.dtype(str(dtype))
+        start = self._header['data_start'] + position
+        if len(section) == 3:
+            size = dtype.itemsize
+            for length in shape:
+                size *= length
+            return self._data[start:start + size].view(dtype).reshape(shape)
+        encoding, size = section[3:]
+        data = self._data[start:start + size].tobytes()
+        return _decode(str(encoding), data, dtype, shape)
+
+#name, dtype and row shape of each column a _ColumnWriter writes
+_COLUMNS = (('offsets', '<i8', []), ('freq_bounds', '<i8', []),
+            ('freqs', '<i8', []), ('pts_axes', '|u1', []),
+            ('x_range', '<i8', [2]), ('y_range', '<f8', [2]),
+            ('text', '|u1', []), ('text_bounds', '<i8', []),
+            ('dice', '|u1', []), ('dice_bounds', '<i8', []),
+            ('big', '|u1', []), ('big_bounds', '<i8', []),
+            ('digest', '|u1', []), ('digest_bounds', '<i8', []),
+            ('checksum', '<u4', []))
+_STRINGS = ('text', 'dice', 'big', 'digest')
+
+class _Spool(object):
+    '''the bytes of one column, kept in a temp file until the file is
+    written. if compress is given, they are compressed as they come.'''
+    def __init__(self, compress=None):
+        self.rows = 0
+        self.size = 0
+        self.file = tempfile.TemporaryFile()
+        self._compressor = None
+        if compress:
+            self._compressor = _COMPRESSORS[compress][0]()
+    def write(self, data, rows):
+        '''adds bytes that hold rows rows of the column'''
+        self.rows += rows
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self.file.write(data)
+        self.size += len(data)
+    def finish(self):
+        '''ends the compressed data and rewinds the file for reading'''
+        if self._compressor is not None:
+            data = self._compressor.flush()
+            self.file.write(data)
+            self.size += len(data)
+            self._compressor = None
+        self.file.seek(0)
+
+class _ColumnWriter(object):
+    '''writes a columnar history file one plot object at a time. each column
+    is spooled to a temp file, so only one plot object needs to be in memory.
+    if compress is 'zlib' or 'lzma', the _COMPRESSED columns are encoded.'''
+    def __init__(self, compress=None):
+        if compress is not None and compress not in _COMPRESSORS:
+            raise ValueError('unknown compression: {}'.format(compress))
+        self.compress = compress
+        self.count = 0
+        self._spools = OrderedDict()
+        for name, _, _ in _COLUMNS:
+            self._spools[name] = _Spool(compress if name in _COMPRESSED
+                                        else None)
+        self._bounds = {'freq_bounds': 0}
+        for name in _STRINGS:
+            self._bounds[name + '_bounds'] = 0
+        for name in self._bounds:
+            self._spools[name].write(np.zeros(1, dtype='<i8').tobytes(), 1)
+        self._last_freq = 0
+    def close(self):
+        '''removes the temp files'''
+        for spool in self._spools.values():
+            spool.file.close()
+    def _slice(self, bounds_name, data, rows, checksum):
+        '''adds the bytes of one entry to a column and its bounds'''
+        self._bounds[bounds_name] += rows
+        self._spools[bounds_name].write(
+            np.array([self._bounds[bounds_name]], dtype='<i8').tobytes(), 1)
+        return zlib.crc32(data, checksum)
+    def add(self, plot_obj):
+        '''adds a plot object. raises ValueError if it doesn't pass
+        check_data.'''
+        msg = check_data(plot_obj)
+        if msg != 'ok':
+            raise ValueError(msg)
+        frequencies = fm.Frequencies.from_tuple_list(plot_obj['tuple_list'])
+        if frequencies.array.dtype == np.dtype('O'):
+            big = ','.join('{:x}'.format(val) for val in
+                           frequencies.array.tolist())
+            freqs = np.zeros(0, dtype='<i8')
+        else:
+            big = ''
+            freqs = frequencies.array.astype('<i8')
+        rows = [('offsets', np.array([frequencies.offset], dtype='<i8')),
+                ('pts_axes', np.array([without_pts(plot_obj)['axes']],
+                                      dtype='|u1')),
+                ('x_range', np.array([plot_obj['x_range']], dtype='<i8')),
+                ('y_range', np.array([plot_obj['y_range']], dtype='<f8'))]
+        checksum = 0
+        for name, row in rows:
+            data = row.tobytes()
+            checksum = zlib.crc32(data, checksum)
+            self._spools[name].write(data, 1)
+        data = freqs.tobytes()
+        if self.compress:
+            self._spools['freqs'].write(
+                _delta_encode(freqs, self._last_freq), len(freqs))
+            if freqs.size:
+                self._last_freq = int(freqs[-1])
+        else:
+            self._spools['freqs'].write(data, len(freqs))
+        checksum = self._slice('freq_bounds', data, len(freqs),
+                               checksum)
+        strings = {'text': plot_obj['text'],
+                   'dice': _dice_spec(plot_obj['dice']), 'big': big,
+                   'digest': frequencies.digest()}
+        for name in _STRINGS:
+            data = strings[name].encode('utf-8')
+            self._spools[name].write(data, len(data))
+            checksum = self._slice(name + '_bounds', data, len(data),
+                                   checksum)
+        self._spools['checksum'].write(
+            np.array([checksum & 0xffffffff], dtype='<u4').tobytes(), 1)
+        self.count += 1
+    def write(self, file_):
+        '''writes the prefix, the json header and each column, little-endian
+        and aligned so it can be viewed straight from a memory map.'''
+        sections = {}
+        position = 0
+        for name, dtype, shape in _COLUMNS:
+            spool = self._spools[name]
+            spool.finish()
+            sections[name] = [position, dtype, [spool.rows] + shape]
+            if self.compress and name in _COMPRESSED:
+                encoding = self.compress
+                if name == 'freqs':
+                    encoding = 'delta+' + encoding
+                sections[name] += [encoding, spool.size]
+            position += -(-spool.size // _ALIGN) * _ALIGN
+        header = {'count': self.count, 'sections': sections}
+        data_start = 0
+        while True:
+            header['data_start'] = data_start
+            header['size'] = data_start + position
+            header_bytes = json.dumps(header, sort_keys=True).encode('ascii')
+            needed = -(-(_PREFIX.size + len(header_bytes)) // _ALIGN) * _ALIGN
+            if needed <= data_start:
+                break
+            data_start = needed
+        file_.write(_PREFIX.pack(HISTORY_MAGIC, HISTORY_VERSION,
+                                 len(header_bytes)))
+        file_.write(header_bytes)
+        file_.write(b'\0' * (data_start - _PREFIX.size - len(header_bytes)))
+        for name, _, _ in _COLUMNS:
+            spool = self._spools[name]
+            shutil.copyfileobj(spool.file, file_)
+            file_.write(b'\0' * (-spool.size % _ALIGN))
+
+def _read_columns(file_name):
+    '''memory maps a columnar history file. returns (count, _Columns).'''
+    with open(file_name, 'rb') as file_:
+        magic, version, header_size = _PREFIX.unpack(
+            file_.read(_PREFIX.size))
+        if magic != HISTORY_MAGIC or version > HISTORY_VERSION:
+            raise ValueError('not a known history file')
+        header = json.loads(file_.read(header_size).decode('ascii'))
+    data = np.memmap(file_name, dtype=np.uint8, mode='r')
+    if data.size != header['size']:
+        raise ValueError('history file is the wrong size')
+    return header['count'], _Columns(data.view(np.ndarray), header)
+
+def _check_columns(count, columns):
+    '''cheap checks that every column has count entries and the bounds fit
+    their columns, so reading an entry can't reach into another one. raises
+    ValueError'''
+    for name in _ENTRY_ROWS + ('checksum',):
+        if name in columns and columns.rows(name) != count:
+            raise ValueError('{} is the wrong size'.format(name))
+    for name, bounds_name in _ENTRY_SLICES:
+        bounds = columns.get(bounds_name)
+        if bounds is None:
+            continue
+        if (len(bounds) != count + 1 or bounds[0] != 0 or
+                bounds[-1] != columns.rows(name) or
+                np.any(np.diff(bounds) < 0)):
+            raise ValueError('{} is corrupted'.format(bounds_name))
+
+class _ColumnHistory(object):
+    '''the entries of a columnar history file. the small columns are read
+    at once; frequencies and dice are read when an entry is asked for. pts
+    in files before version 5 are not used.'''
+    def __init__(self, count, columns):
+        _check_columns(count, columns)
+        self.count = count
+        self._columns = columns
+        self._offsets = columns['offsets'].tolist()
+        self._freq_bounds = columns['freq_bounds'].tolist()
+        self._big_bounds = columns['big_bounds'].tolist()
+        self._texts = self._strings('text')
+        self._digests = [None] * count
+        if 'digest' in columns:
+            self._digests = self._strings('digest')
+    def _strings(self, name):
+        '''the list of strings in a string column'''
+        data = self._columns[name].tobytes()
+        bounds = self._columns[name + '_bounds'].tolist()
+        return [_to_str(data[bounds[index]:bounds[index + 1]])
+                for index in range(self.count)]
+    def _string(self, name, index):
+        '''one string of a string column'''
+        bounds = self._columns[name + '_bounds'][index:index + 2].tolist()
+        return _to_str(self._columns[name][bounds[0]:bounds[1]].tobytes())
+    def checksum_matches(self, index):
+        '''True if the entry has a stored checksum and its bytes still match
+        it'''
+        if 'checksum' not in self._columns:
+            return False
+        return (int(self._columns['checksum'][index]) ==
+                _entry_checksum(self._columns, index))
+    def text(self, index):
+        '''the text of an entry'''
+        return self._texts[index]
+    def _array(self, index):
+        '''the frequency array of an entry'''
+        if self._big_bounds[index] != self._big_bounds[index + 1]:
+            return np.array([int(val, 16) for val in
+                             self._string('big', index).split(',')],
+                            dtype=object)
+        start, stop = self._freq_bounds[index:index + 2]
+        return self._columns['freqs'][start:stop]
+    def frequencies(self, index):
+        '''the fm.Frequencies of an entry. the array is read when needed'''
+        return fm.Frequencies.from_file(self._offsets[index],
+                                        lambda: self._array(index),
+                                        self._digests[index])
+    def plot_obj(self, index, frequencies=None):
+        '''makes the plot object of an entry, without pts. it isn't
+        checked.'''
+        if frequencies is None:
+            frequencies = self.frequencies(index)
+        columns = self._columns
+        return {'text': self._texts[index],
+                'tuple_list': frequencies,
+                'axes': bool(columns['pts_axes'][index]),
+                'x_range': tuple(columns['x_range'][index].tolist()),
+                'y_range': tuple(columns['y_range'][index].tolist()),
+                'dice': _dice_from_spec(self._string('dice', index))}
+
+def _column_objects(source):
+    '''makes the plot objects of a _ColumnHistory. the frequencies are views
+    of the columns. returns (all of them, the ones that need checking)'''
+    history = np.empty(source.count, dtype=object)
+    unchecked = []
+    for index in range(source.count):
+        history[index] = source.plot_obj(index)
+        if not source.checksum_matches(index):
+            unchecked.append(history[index])
+    return history, unchecked
+
+def _replace(source, destination):
+    '''moves source over destination in one step, so destination is never
+    half written'''
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        #python2 has no os.replace. os.rename is atomic except on windows
+        if os.name == 'nt' and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+def _write_file(writer, file_name):
+    '''writes a _ColumnWriter to a temp file that then replaces file_name'''
+    temp_file = file_name + '.tmp'
+    try:
+        with open(temp_file, 'wb') as file_:
+            writer.write(file_)
+            file_.flush()
+            os.fsync(file_.fileno())
+    finally:
+        writer.close()
+    _replace(temp_file, file_name)
+
+def write_history_np(history, compress=None):
+    '''takes a numpy array of plot objects and writes it as a columnar file.
+    pts are not written, see without_pts. it's written to a temp file that
+    then replaces the old one. the journal is emptied, since the file now has
+    everything. compress is None, 'zlib' or 'lzma' (if python has it).
+    compressed files are smaller, but the compressed columns can't be memory
+    mapped. raises ValueError if a plot object doesn't pass check_data or
+    compress is unknown.'''
+    writer = _ColumnWriter(compress)
+    try:
+        for plot_obj in history:
+            writer.add(plot_obj)
+    except ValueError:
+        writer.close()
+        raise
+    _write_file(writer, HISTORY_FILE)
+    clear_journal()
+
+def append_journal(records):
+    '''appends records to the journal. each record is ('add', plot_obj),
+    ('remove', (text, digest)) or ('clear', None). a record is a 4-byte
+    length and then the pickled record.'''
+    with open(JOURNAL_FILE, 'ab') as file_:
+        for record in records:
+            data = pickle.dumps(record, 2)
+            file_.write(struct.pack('<I', len(data)) + data)
+        file_.flush()
+        os.fsync(file_.fileno())
+
+def read_journal(repair=False):
+    '''returns the list of records in the journal. a record that was cut off
+    by a crash ends the list. with repair, the file is cut back to the
+    records before it, so records appended later can be read. raises
+    IOError or OSError if that fails. see append_journal'''
+    records = []
+    try:
+        with open(JOURNAL_FILE, 'rb') as file_:
+            data = file_.read()
+    except IOError:
+        return records
+    end = 0
+    while end + 4 <= len(data):
+        size = struct.unpack('<I', data[end:end + 4])[0]
+        if end + 4 + size > len(data):
+            break
+        try:
+            records.append(pickle.loads(data[end + 4:end + 4 + size]))
+        except (UnpicklingError, AttributeError, EOFError, ImportError,
+                IndexError, ValueError, TypeError):
+            break
+        end += 4 + size
+    if repair and end < len(data):
+        with open(JOURNAL_FILE, 'r+b') as file_:
+            file_.truncate(end)
+            file_.flush()
+            os.fsync(file_.fileno())
+    return records
+
+def clear_journal():
+    '''removes the journal'''
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+
+_CORRUPTED = (UnpicklingError, AttributeError, EOFError, ImportError,
+              IndexError, ValueError, KeyError, TypeError, SyntaxError,
+              struct.error, zlib.error)
+if lzma is not None:
+    _CORRUPTED += (lzma.LZMAError,)
+
+def _read_legacy(file_name=None):
+    '''reads a history file that is a pickled numpy object array'''
+    if file_name is None:
+        file_name = HISTORY_FILE
+    try:
+        return np.load(file_name, allow_pickle=True)
+    except TypeError:
+        #numpy before 1.10 has no allow_pickle and always allows it
+        return np.load(file_name)
 
 def read_history_np():
-    '''tries to find the np file and read it returns a np array and a message'''
+    '''tries to find the history file and read it returns a np array and a
+    message. the plot objects are without pts, see without_pts. the
+    frequencies of a columnar file are memory mapped.'''
     empty_hist = np.array([], dtype=object)
     try:
-        history = np.load('numpy_history.npy')
+        with open(HISTORY_FILE, 'rb') as file_:
+            magic = file_.read(len(HISTORY_MAGIC))
+        if magic == HISTORY_MAGIC:
+            history, unchecked = _column_objects(
+                _ColumnHistory(*_read_columns(HISTORY_FILE)))
+        else:
+            history = unchecked = _read_legacy()
         if history.size:
-            msg = check_history(history)
+            msg = check_history(unchecked)
             if 'error:' in msg:
                 history = empty_hist
+            else:
+                _use_frequencies(history)
         else:
             if history.dtype != np.dtype('O'):
                 msg = 'error: wrong array type'
@@ -94,9 +702,134 @@ def read_history_np():
     except IOError:
         history = empty_hist
         msg = 'error: no file'
-    except (UnpicklingError, AttributeError, EOFError, ImportError,
-            IndexError, ValueError):
+    except _CORRUPTED:
         history = empty_hist
         msg = 'error: file corrupted'
     return msg, history
 
+def _checked_loader(source, index, frequencies):
+    '''returns a function that makes and checks the plot object of an entry.
+    it raises ValueError if the entry is corrupted.'''
+    def load():
+        '''the checked plot object'''
+        try:
+            plot_obj = source.plot_obj(index, frequencies)
+            msg = 'ok'
+            if not source.checksum_matches(index):
+                msg = check_data(plot_obj)
+        except _CORRUPTED:
+            msg = 'error: entry corrupted'
+        if msg != 'ok':
+            raise ValueError(msg)
+        return plot_obj
+    return load
+
+def read_history_index():
+    '''reads only what is needed to list the history. returns a message and a
+    list of (text, fm.Frequencies, load) for each entry. load() returns the
+    plot object without pts, or raises ValueError if that entry is corrupted.
+    a columnar file's frequencies aren't read until they're needed and the
+    rest of an entry until load is called. a pickled file is read all at
+    once, as in read_history_np.'''
+    try:
+        with open(HISTORY_FILE, 'rb') as file_:
+            magic = file_.read(len(HISTORY_MAGIC))
+        if magic != HISTORY_MAGIC:
+            msg, history = read_history_np()
+            return msg, [(plot_obj['text'], plot_obj['tuple_list'],
+                          (lambda plot_obj=plot_obj: plot_obj))
+                         for plot_obj in history]
+        source = _ColumnHistory(*_read_columns(HISTORY_FILE))
+    except IOError:
+        return 'error: no file', []
+    except _CORRUPTED:
+        return 'error: file corrupted', []
+    entries = []
+    for index in range(source.count):
+        frequencies = source.frequencies(index)
+        entries.append((source.text(index), frequencies,
+                        _checked_loader(source, index, frequencies)))
+    return ('ok' if entries else 'ok: no history'), entries
+
+def _file_format(file_name):
+    '''returns (version, compress) of a columnar history file, or (None,
+    None) for a pickled one'''
+    with open(file_name, 'rb') as file_:
+        magic = file_.read(len(HISTORY_MAGIC))
+    if magic != HISTORY_MAGIC:
+        return None, None
+    with open(file_name, 'rb') as file_:
+        _, version, header_size = _PREFIX.unpack(file_.read(_PREFIX.size))
+        header = json.loads(file_.read(header_size).decode('ascii'))
+    freqs = header['sections']['freqs']
+    return version, (freqs[3].rpartition('+')[2] if len(freqs) > 3 else None)
+
+def _migration_source(file_name):
+    '''returns the number of entries in a history file of any format and a
+    function that takes an index and returns that plot object. returns None
+    for a pickled array of the wrong type.'''
+    if _file_format(file_name)[0] is not None:
+        source = _ColumnHistory(*_read_columns(file_name))
+        return source.count, source.plot_obj
+    history = _read_legacy(file_name)
+    if history.dtype != np.dtype('O'):
+        return None
+    history = history.reshape(-1)
+    def plot_obj(index):
+        '''the plot object. what's read doesn't need to stay in memory'''
+        plot_obj = history[index]
+        history[index] = None
+        return plot_obj
+    return history.size, plot_obj
+
+def _migrated(source, compress, errors):
+    '''writes every entry of a _migration_source that passes check_data to a
+    _ColumnWriter and returns it. the entries that don't are added to errors
+    as (index, message).'''
+    count, plot_obj = source
+    writer = _ColumnWriter(compress)
+    try:
+        for index in range(count):
+            try:
+                writer.add(plot_obj(index))
+            except ValueError as error:
+                errors.append((index, str(error)))
+            except _CORRUPTED:
+                errors.append((index, 'error: entry corrupted'))
+    except BaseException:
+        writer.close()
+        raise
+    return writer
+
+def migrate_history(file_name=None, compress=None):
+    '''converts a history file of any older format, pickled or columnar, to
+    the current one, one entry at a time. entries that don't pass check_data
+    are left out and the rest are kept. the first time a file is migrated,
+    the original is copied to file_name + '.legacy'. a file that is already
+    current, with the same compress, is left alone. returns a message and a
+    list of (index, message) for the entries left out.'''
+    if file_name is None:
+        file_name = HISTORY_FILE
+    if compress is not None and compress not in _COMPRESSORS:
+        raise ValueError('unknown compression: {}'.format(compress))
+    errors = []
+    try:
+        if _file_format(file_name) == (HISTORY_VERSION, compress):
+            return 'ok: up to date', errors
+        source = _migration_source(file_name)
+        if source is None:
+            return 'error: wrong array type', errors
+        writer = _migrated(source, compress, errors)
+        #windows can't replace a file that is memory mapped
+        del source
+    except IOError:
+        return 'error: no file', errors
+    except _CORRUPTED:
+        return 'error: file corrupted', errors
+    backup = file_name + '.legacy'
+    if not os.path.exists(backup):
+        shutil.copyfile(file_name, backup)
+    _write_file(writer, file_name)
+    if errors:
+        return 'ok: migrated, {} entries left out'.format(len(errors)), errors
+    return 'ok: migrated', errors
@@ -0,0 +1,608 @@
+'''numpy math for the frequencies of a table. frequencies are passed around as
+an offset and an array, where array[index] is the frequency of the roll
+offset + index. arrays are int64 when the frequencies are small enough and
+dtype=object (python longs) when they aren't.'''
+
+from __future__ import absolute_import
+
+import hashlib
+import sys
+from collections import OrderedDict
+from operator import mul
+
+import numpy as np
+
+#convolutions whose biggest possible value is below these limits are done
+#with float FFT or int64 np.convolve. both give exact answers there.
+FFT_LIMIT = 2**40
+INT64_LIMIT = 2**62
+#below this size, np.convolve beats the FFT
+FFT_MIN_SIZE = 64
+#below this divisor size, dividing one value at a time beats newton's method
+LONG_DIVIDE_SIZE = 256
+
+def _max_value(array):
+    '''returns the largest value in array as a python int'''
+    return int(array.max())
+
+def from_tuple_list(tuple_list):
+    '''tuple_list is [(roll, frequency), ...] with at least one non-zero
+    frequency. returns (offset, array) with zeros filled in between rolls.'''
+    pairs = [(roll, freq) for roll, freq in tuple_list if freq != 0]
+    if not pairs:
+        raise ValueError('cannot use an empty list')
+    rolls = [roll for roll, _ in pairs]
+    freqs = [freq for _, freq in pairs]
+    offset = min(rolls)
+    if max(freqs) < INT64_LIMIT:
+        array = np.zeros(max(rolls) - offset + 1, dtype=np.int64)
+    else:
+        array = np.zeros(max(rolls) - offset + 1, dtype=object)
+    for roll, freq in pairs:
+        array[roll - offset] += freq
+    return offset, array
+
+def to_tuple_list(offset, array):
+    '''returns [(roll, frequency), ...] for every non-zero frequency in array.
+    all numbers are python ints.'''
+    indices = np.nonzero(array)[0]
+    freqs = array[indices].tolist()
+    return [(offset + int(index), int(freq))
+            for index, freq in zip(indices, freqs)]
+
+def die_frequencies(die):
+    '''die is a child of dt.ProtoDie. returns (offset, array)'''
+    return from_tuple_list(die.tuple_list())
+
+def _fft_convolve(first, second):
+    '''float FFT convolution of int64 arrays. returns None if rounding is too
+    far off to trust the answer.'''
+    size = len(first) + len(second) - 1
+    fft_size = 1
+    while fft_size < size:
+        fft_size *= 2
+    raw = np.fft.irfft(np.fft.rfft(first, fft_size) *
+                       np.fft.rfft(second, fft_size), fft_size)[:size]
+    rounded = np.rint(raw)
+    if np.abs(raw - rounded).max() > 0.25:
+        return None
+    return rounded.astype(np.int64)
+
+_SMALL_PRIMES = []
+_PRIMES = {}
+
+def _small_primes():
+    '''returns an array of all primes below 2**16, for testing primes that
+    fit in 32 bits'''
+    if not _SMALL_PRIMES:
+        sieve = np.ones(2**16, dtype=bool)
+        sieve[:2] = False
+        for num in range(2, 2**8):
+            if sieve[num]:
+                sieve[num * num::num] = False
+        _SMALL_PRIMES.append(np.nonzero(sieve)[0].astype(np.int64))
+    return _SMALL_PRIMES[0]
+
+def _primes(bits, number):
+    '''returns a list of the biggest number primes below 2**bits, or as many
+    as there are. bits <= 32.'''
+    found = _PRIMES.setdefault(bits, [])
+    top = found[-1] if found else 2**bits
+    small = _small_primes()
+    while len(found) < number and top > 2:
+        candidates = np.arange(top - 1, max(1, top - 1024), -1, dtype=np.int64)
+        divisors = small[small * small < top]
+        column = candidates[:, np.newaxis]
+        is_prime = np.all((column % divisors != 0) | (column == divisors),
+                          axis=1)
+        found.extend(int(prime) for prime in candidates[is_prime])
+        top = int(candidates[-1])
+    return found[:number]
+
+def _piece_products(first, second, size):
+    '''first and second are 2-D arrays of pieces of residues, [low, high].
+    returns the stacked convolutions (low*low, low*high + high*low,
+    high*high), exact as long as none of them pass FFT_LIMIT.'''
+    fft_size = 1
+    while fft_size < size:
+        fft_size *= 2
+    low_1, high_1 = [np.fft.rfft(piece, fft_size, axis=1) for piece in first]
+    low_2, high_2 = [np.fft.rfft(piece, fft_size, axis=1) for piece in second]
+    products = []
+    for transformed in (low_1 * low_2, low_1 * high_2 + high_1 * low_2,
+                        high_1 * high_2):
+        raw = np.fft.irfft(transformed, fft_size, axis=1)[:, :size]
+        rounded = np.rint(raw)
+        if np.abs(raw - rounded).max() > 0.25:
+            break
+        products.append(rounded.astype(np.int64))
+    else:
+        return products
+    #the FFT couldn't be trusted, so np.convolve each row
+    low_1, high_1 = first
+    low_2, high_2 = second
+    products = [np.zeros((len(low_1), size), dtype=np.int64) for _ in range(3)]
+    for row in range(len(low_1)):
+        products[0][row] = np.convolve(low_1[row], low_2[row])
+        products[1][row] = (np.convolve(low_1[row], high_2[row]) +
+                            np.convolve(high_1[row], low_2[row]))
+        products[2][row] = np.convolve(high_1[row], high_2[row])
+    return products
+
+def _mod_convolve(first, second, primes, piece_bits):
+    '''first and second are 2-D int64 arrays with a row of residues for each
+    prime. primes are < 2**(2*piece_bits). returns the 2-D residues of the
+    convolution, mod each prime.'''
+    size = first.shape[1] + second.shape[1] - 1
+    mods = np.array(primes, dtype=np.int64).reshape(-1, 1)
+    if min(first.shape[1], second.shape[1]) < FFT_MIN_SIZE:
+        if first.shape[1] < second.shape[1]:
+            first, second = second, first
+        answer = np.zeros((len(primes), size), dtype=np.int64)
+        for index in range(second.shape[1]):
+            answer[:, index:index + first.shape[1]] += (
+                first * second[:, index:index + 1] % mods)
+        return answer % mods
+    mask = 2**piece_bits - 1
+    low_low, middle, high_high = _piece_products(
+        [first & mask, first >> piece_bits],
+        [second & mask, second >> piece_bits],
+        size
+        )
+    shift = np.array([pow(2, 2 * piece_bits, prime) for prime in primes],
+                     dtype=np.int64).reshape(-1, 1)
+    answer = (middle % mods) * 2**piece_bits % mods
+    answer += (high_high % mods) * shift % mods
+    answer += low_low % mods
+    return answer % mods
+
+def _residues(array, primes):
+    '''returns a 2-D int64 array, array mod each prime. python longs are
+    reduced mod two primes at a time so that numpy can do the rest.'''
+    if array.dtype != np.dtype('O'):
+        return np.array([array % prime for prime in primes], dtype=np.int64)
+    rows = []
+    for index in range(0, len(primes), 2):
+        pair = primes[index:index + 2]
+        reduced = (array % (pair[0] * pair[-1])).astype(np.int64)
+        rows.extend(reduced % prime for prime in pair)
+    return np.array(rows, dtype=np.int64)
+
+def _chinese_remainder(residues, primes):
+    '''residues is a 2-D array of a row of residues for each prime. returns
+    the dtype=object array of numbers that match those residues and are less
+    than the product of primes. uses Garner's algorithm so that all but the
+    last step are int64. the last step joins two digits at a time.'''
+    digits = []
+    for index, prime in enumerate(primes):
+        below = np.zeros(residues.shape[1], dtype=np.int64)
+        multiplier = 1
+        for digit, other in zip(digits, primes[:index]):
+            below = (below + digit * multiplier) % prime
+            multiplier = multiplier * other % prime
+        inverse = pow(multiplier, prime - 2, prime)
+        digits.append((residues[index] - below) % prime * inverse % prime)
+    pairs = []
+    for index in range(0, len(primes), 2):
+        if index + 1 < len(primes):
+            pairs.append((digits[index] + digits[index + 1] * primes[index],
+                          primes[index] * primes[index + 1]))
+        else:
+            pairs.append((digits[index], primes[index]))
+    answer = pairs[-1][0].astype(object)
+    for digit, prime_product in pairs[-2::-1]:
+        answer = answer * prime_product + digit.astype(object)
+    return answer
+
+def _modulus_plan(size, bound, avoid=1):
+    '''returns (primes, piece_bits) for exact math mod primes on arrays up to
+    size long with values up to bound. primes that divide avoid are skipped.
+    returns None if there aren't enough primes.'''
+    size_bits = len(bin(size)) - 2
+    fft_bits = len(bin(FFT_LIMIT)) - 3
+    piece_bits = min(15, (fft_bits - 2 - size_bits) // 2)
+    if piece_bits < 2:
+        return None
+    needed = 2 + (len(bin(bound)) - 2) // (2 * piece_bits - 1)
+    primes = []
+    product = 1
+    for prime in _primes(2 * piece_bits, needed + 4):
+        if avoid % prime == 0:
+            continue
+        primes.append(prime)
+        product *= prime
+        if product > bound:
+            return primes, piece_bits
+    return None
+
+def _long_convolve(first, second):
+    '''exact convolution with python longs'''
+    return np.convolve(first.astype(object), second.astype(object))
+
+def _power(array, number, multiply, one):
+    '''array multiplied by itself number times with multiply(), by repeated
+    squaring. one is what multiply treats as 1.'''
+    answer = one
+    base = array
+    while number:
+        if number & 1:
+            answer = multiply(answer, base)
+        number >>= 1
+        if number:
+            base = multiply(base, base)
+    return answer
+
+def total(array):
+    '''returns the sum of array as a python int'''
+    return sum(array.tolist())
+
+def _bit_lengths(array):
+    '''the bit_length of each python int in a dtype=object array'''
+    return np.frompyfunc(lambda value: value.bit_length(), 1, 1)(
+        array).astype(np.int64)
+
+def percents(array):
+    '''returns the percent of the total of each frequency in array as a
+    float64 array. python longs too big for a float are kept as a 62-bit
+    mantissa and a power of two, so huge frequencies neither overflow nor
+    lose precision, and percents too small for a float are 0.0.'''
+    the_total = total(array)
+    if array.dtype != np.dtype('O'):
+        return array * (100. / the_total)
+    shifts = np.maximum(_bit_lengths(array) - 62, 0)
+    mantissas = (array >> shifts.astype(object)).astype(np.float64)
+    total_shift = max(the_total.bit_length() - 62, 0)
+    total_mantissa = float(the_total >> total_shift)
+    return np.ldexp(mantissas * (100. / total_mantissa), shifts - total_shift)
+
+def running_total(array):
+    '''returns an array one longer than array where answer[i] is the sum of
+    array[:i]. range sums are then answer[stop] - answer[start].'''
+    if array.dtype != np.dtype('O') and total(array) >= INT64_LIMIT:
+        array = array.astype(object)
+    answer = np.zeros(len(array) + 1, dtype=array.dtype)
+    answer[1:] = np.cumsum(array)
+    return answer
+
+def convolve(first, second):
+    '''returns the exact convolution of two frequency arrays. uses float FFT
+    where it's exact, int64 where it won't overflow, and int64 math mod several
+    primes for the rest.'''
+    bound = min(_max_value(first) * total(second),
+                _max_value(second) * total(first))
+    if bound >= INT64_LIMIT:
+        #a short array costs less to do directly than to convert to residues
+        if min(len(first), len(second)) < FFT_MIN_SIZE:
+            return _long_convolve(first, second)
+        return product([(0, first, 1), (0, second, 1)])[1]
+    first = first.astype(np.int64)
+    second = second.astype(np.int64)
+    if bound < FFT_LIMIT and min(len(first), len(second)) >= FFT_MIN_SIZE:
+        answer = _fft_convolve(first, second)
+        if answer is not None:
+            return answer
+    return np.convolve(first, second)
+
+def product(terms):
+    '''terms is a list of (offset, array, number). returns (offset, array) of
+    all the arrays convolved together, each one number times. number is
+    int >= 0. when the answer won't fit in int64, all the work is done mod
+    several primes and put back together once at the end with the chinese
+    remainder theorem.'''
+    offset = 0
+    size = 1
+    bound = 1
+    for term_offset, array, number in terms:
+        if number < 0:
+            raise ValueError('number must be a positive int')
+        offset += term_offset * number
+        size += (len(array) - 1) * number
+        bound *= total(array) ** number
+    if bound < INT64_LIMIT:
+        multiply = convolve
+        one = np.array([1], dtype=np.int64)
+        convert = back = lambda array: array
+    else:
+        plan = _modulus_plan(size, bound)
+        if plan is None:
+            multiply = _long_convolve
+            one = np.array([1], dtype=object)
+            convert = back = lambda array: array
+        else:
+            primes, piece_bits = plan
+            multiply = lambda first, second: _mod_convolve(first, second,
+                                                           primes, piece_bits)
+            one = np.ones((len(primes), 1), dtype=np.int64)
+            convert = lambda array: _residues(array, primes)
+            back = lambda residues: _chinese_remainder(residues, primes)
+    answer = one
+    for _, array, number in terms:
+        if number:
+            answer = multiply(answer,
+                              _power(convert(array), number, multiply, one))
+    return offset, back(answer)
+
+def power(offset, array, number):
+    '''returns (offset, array) of the frequencies convolved with themselves
+    number times, by repeated squaring. number is int >= 0.'''
+    return product([(offset, array, number)])
+
+def add_dice(offset, array, die, number):
+    '''returns (offset, array) of the frequencies with number of die added.
+    die is a child of dt.ProtoDie. number is int >= 0.'''
+    die_offset, die_array = die_frequencies(die)
+    add_offset, to_add = power(die_offset, die_array, number)
+    return offset + add_offset, convolve(array, to_add)
+
+def _mod_inverse_series(divisor, size, primes, piece_bits):
+    '''divisor is 2-D residues with divisor[:, 0] != 0. returns the first size
+    terms of the power series 1/divisor, mod each prime, by newton's
+    method.'''
+    mods = np.array(primes, dtype=np.int64).reshape(-1, 1)
+    inverse = np.array([[pow(int(first), prime - 2, prime)]
+                        for first, prime in zip(divisor[:, 0], primes)],
+                       dtype=np.int64)
+    length = 1
+    while length < size:
+        length = min(2 * length, size)
+        correction = -_mod_convolve(divisor[:, :length], inverse,
+                                    primes, piece_bits)[:, :length] % mods
+        correction[:, 0] = (correction[:, 0] + 2) % mods[:, 0]
+        inverse = _mod_convolve(inverse, correction,
+                                primes, piece_bits)[:, :length]
+    return inverse
+
+def _long_divide(dividend, divisor):
+    '''polynomial division with python longs, one value at a time. every
+    step must divide evenly and the values left over at the end must match
+    the dividend, or ValueError is raised.'''
+    dividend = dividend.tolist()
+    divisor = divisor.tolist()
+    first = divisor[0]
+    reverse = divisor[:0:-1]
+    quotient = []
+    for index in range(len(dividend) - len(divisor) + 1):
+        window = quotient[max(0, index - len(reverse)):index]
+        value = dividend[index] - sum(map(mul, reverse[-len(window):], window))
+        answer, remainder = divmod(value, first)
+        if remainder or answer < 0:
+            raise ValueError('not divisible')
+        quotient.append(answer)
+    for index in range(len(quotient), len(dividend)):
+        start = max(0, index - len(divisor) + 1)
+        products = [divisor[index - place] * quotient[place]
+                    for place in range(start, len(quotient))]
+        if sum(products) != dividend[index]:
+            raise ValueError('not divisible')
+    return np.array(quotient, dtype=object)
+
+def divide(dividend, divisor):
+    '''returns the exact array that convolves with divisor to make dividend,
+    by polynomial division. the answer is checked by multiplying it back out,
+    and ValueError is raised if dividend isn't divisible by divisor.'''
+    size = len(dividend) - len(divisor) + 1
+    dividend_total = total(dividend)
+    divisor_total = total(divisor)
+    if size < 1 or dividend_total % divisor_total:
+        raise ValueError('not divisible')
+    plan = _modulus_plan(len(dividend), dividend_total, int(divisor[0]))
+    if plan is None or len(divisor) < LONG_DIVIDE_SIZE:
+        quotient = _long_divide(dividend, divisor)
+    else:
+        primes, piece_bits = plan
+        dividend_res = _residues(dividend, primes)
+        divisor_res = _residues(divisor, primes)
+        inverse = _mod_inverse_series(divisor_res, size, primes, piece_bits)
+        quotient_res = _mod_convolve(dividend_res[:, :size], inverse,
+                                     primes, piece_bits)[:, :size]
+        quotient = _chinese_remainder(quotient_res, primes)
+        #quotient is non-negative and < product of primes. if its total is
+        #right, every value of quotient * divisor is <= dividend_total <
+        #product of primes, so matching mod every prime means matching exactly
+        check = _mod_convolve(quotient_res, divisor_res, primes, piece_bits)
+        if (total(quotient) * divisor_total != dividend_total or
+                not np.array_equal(check, dividend_res)):
+            raise ValueError('not divisible')
+    if dividend.dtype != np.dtype('O'):
+        quotient = quotient.astype(np.int64)
+    return quotient
+
+def remove_dice(offset, array, die, number):
+    '''returns (offset, array) of the frequencies with number of die taken
+    out. die is a child of dt.ProtoDie. number is int >= 0. raises ValueError
+    if the frequencies don't contain those dice.'''
+    die_offset, die_array = die_frequencies(die)
+    remove_offset, to_remove = power(die_offset, die_array, number)
+    return offset - remove_offset, divide(array, to_remove)
+
+def array_bytes(array):
+    '''returns about how many bytes of memory array uses, including the
+    python longs of a dtype=object array.'''
+    size = array.nbytes
+    if array.dtype == np.dtype('O'):
+        size += sum(sys.getsizeof(value) for value in array.tolist())
+    return size
+
+class FrequencyCache(object):
+    '''a least recently used cache of (offset, array) frequencies. the oldest
+    are thrown out when the arrays use more than max_bytes. the arrays it
+    returns are read-only.'''
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._store = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+    def __len__(self):
+        return len(self._store)
+    def __contains__(self, key):
+        return key in self._store
+    def _trim(self):
+        '''removes the least recently used until under max_bytes'''
+        while self._bytes > self._max_bytes:
+            _, (_, _, size) = self._store.popitem(last=False)
+            self._bytes -= size
+    def set_max_bytes(self, max_bytes):
+        '''changes the memory budget, throwing out what doesn't fit'''
+        self._max_bytes = max_bytes
+        self._trim()
+    def get(self, key):
+        '''returns (offset, array) or None if key isn't there'''
+        if key not in self._store:
+            self._misses += 1
+            return None
+        self._hits += 1
+        value = self._store.pop(key)
+        self._store[key] = value
+        return value[:2]
+    def put(self, key, offset, array):
+        '''stores a read-only view of array. arrays bigger than max_bytes are
+        not stored.'''
+        if key in self._store:
+            self._bytes -= self._store.pop(key)[2]
+        size = array_bytes(array)
+        if size <= self._max_bytes:
+            array = array.view()
+            array.flags.writeable = False
+            self._store[key] = (offset, array, size)
+            self._bytes += size
+            self._trim()
+    def clear(self):
+        '''empties the cache and resets hits and misses'''
+        self._store = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+    def info(self):
+        '''returns a dict of hits, misses, entries, bytes and max_bytes'''
+        return {'hits': self._hits, 'misses': self._misses,
+                'entries': len(self._store), 'bytes': self._bytes,
+                'max_bytes': self._max_bytes}
+
+class Frequencies(object):
+    '''the frequencies of a table as an offset and a read-only array. the
+    zeros at each end are trimmed so equal frequencies always have equal
+    offsets and arrays. compares equal to the matching tuple_list, so it can
+    stand in for one. see from_file for frequencies whose array is only made
+    when it's needed.'''
+    __slots__ = ('_offset', '_array', '_digest', '_load')
+    def __init__(self, offset, array):
+        non_zero = np.nonzero(array)[0]
+        if not non_zero.size:
+            raise ValueError('cannot use an empty array')
+        if non_zero[0] or non_zero[-1] != len(array) - 1:
+            offset += int(non_zero[0])
+            array = array[non_zero[0]:non_zero[-1] + 1]
+        array = array.view()
+        array.flags.writeable = False
+        self._offset = offset
+        self._array = array
+        self._digest = None
+        self._load = None
+    @classmethod
+    def from_file(cls, offset, load, digest=None):
+        '''frequencies from a file, that are already trimmed. load() returns
+        the array and isn't called until the array is needed. if digest is
+        given, finding the frequencies by digest doesn't need the array.'''
+        new = cls.__new__(cls)
+        new._offset = offset
+        new._array = None
+        new._digest = digest
+        new._load = load
+        return new
+    @classmethod
+    def from_tuple_list(cls, tuple_list):
+        '''tuple_list is [(roll, frequency), ...] or a Frequencies. returns a
+        Frequencies'''
+        if isinstance(tuple_list, cls):
+            return tuple_list
+        return cls(*from_tuple_list(tuple_list))
+    @property
+    def offset(self):
+        '''the lowest roll'''
+        return self._offset
+    @property
+    def array(self):
+        '''read-only array of the frequency of each roll from offset'''
+        if self._array is None:
+            array = self._load().view()
+            array.flags.writeable = False
+            self._array = array
+            self._load = None
+        return self._array
+    @property
+    def nbytes(self):
+        '''about how many bytes of memory the frequencies use'''
+        return array_bytes(self.array)
+    def values_range(self):
+        '''returns (lowest roll, highest roll)'''
+        return self._offset, self._offset + len(self.array) - 1
+    def total(self):
+        '''returns the total frequency as a python int'''
+        return total(self.array)
+    def digest(self):
+        '''returns a sha1 hex digest of the frequencies. equal Frequencies have
+        equal digests whatever the dtype of their arrays.'''
+        if self._digest is None:
+            array = self.array
+            if (array.dtype == np.dtype('O') and
+                    _max_value(array) < INT64_LIMIT):
+                array = array.astype(np.int64)
+            if array.dtype == np.dtype('O'):
+                data = ','.join(str(val) for val in array.tolist())
+                data = data.encode('ascii')
+            else:
+                data = array.astype('<i8').tobytes()
+            self._digest = hashlib.sha1(
+                str(self._offset).encode('ascii') + b':' + data).hexdigest()
+        return self._digest
+    def tuple_list(self):
+        '''returns the legacy [(roll, frequency), ...] of non-zero rolls'''
+        return to_tuple_list(self._offset, self.array)
+    def __iter__(self):
+        return iter(self.tuple_list())
+    def __len__(self):
+        return int(np.count_nonzero(self.array))
+    def __eq__(self, other):
+        if isinstance(other, Frequencies):
+            if self._digest is not None and other._digest is not None:
+                return (self._offset == other.offset and
+                        self._digest == other._digest)
+            return (self._offset == other.offset and
+                    len(self.array) == len(other.array) and
+                    np.array_equal(self.array, other.array))
+        if isinstance(other, (list, tuple)):
+            return self._equals_tuple_list(list(other))
+        return NotImplemented
+    def _equals_tuple_list(self, other):
+        '''compares to a tuple_list. the zeros at the ends are trimmed, so
+        the first and last rolls and the number of rolls are checked first,
+        and the tuple_list is only made when they all match.'''
+        try:
+            first, last = other[0][0], other[-1][0]
+        except (IndexError, KeyError, TypeError):
+            return self.tuple_list() == other
+        if first != self._offset:
+            return False
+        if (last != self._offset + len(self.array) - 1 or
+                len(other) != len(self)):
+            return False
+        return self.tuple_list() == other
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+    def __hash__(self):
+        return hash(self.digest())
+    def __getstate__(self):
+        return self._offset, self.array
+    def __setstate__(self, state):
+        self._offset, array = state
+        array.flags.writeable = False
+        self._array = array
+        self._digest = None
+        self._load = None
+    def __repr__(self):
+        return 'Frequencies({}, {!r})'.format(self._offset,
+                                               self.array.tolist())
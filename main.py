@@ -402,18 +402,29 @@ class ChangeBox(GridLayout):
 
 
 ###############     GraphBox classes    ###############
+def _plot_points(x_vals, y_vals):
+    '''MeshLinePlot wants a list of (x, y), not numpy arrays'''
+    return list(zip(x_vals.tolist(), y_vals.tolist()))
 # for PlotPopup legend
 # kv file line NONE
-class ListButton(Button):
-    '''simply a button with an object attached'''
-    lst = ListProperty([])
-#for GraphBox.graph_it()
+class LegendButton(Button):
+    '''a button with the MeshLinePlot it stands for attached'''
+    plot = ObjectProperty(None)
+#for GraphBox.graph_pyramids()
 # kv file line 32
 class PlotPopup(Popup):
-    '''popup containing the graph'''
-    def __init__(self, x_range, y_range, plot_list, **kwargs):
+    '''popup containing the graph. plot_list is [(text, pt.DetailPyramid),
+    ...], see mvm.GraphBox.graph_pyramids. each graph plots about max_points
+    of what is on screen, so zooming in shows more detail.'''
+    def __init__(self, x_range, y_range, plot_list, max_points, **kwargs):
         super(PlotPopup, self).__init__(**kwargs)
-        self._plot_list = plot_list
+        self.max_points = max_points
+        self._pyramids = [pyramid for _, pyramid in plot_list]
+        self._plot_list = [
+            (text, _plot_points(*pyramid.points(x_range[0], x_range[1],
+                                                max_points)))
+            for text, pyramid in plot_list]
+        self._plots = []
         self.x_range = list(x_range)
         self.y_range = [0, y_range[1]]
         self.legend = DropDown(dismiss_on_select=False)
@@ -424,6 +435,26 @@ class PlotPopup(Popup):
             ]
         self.make_graph()
         self.make_legend()
+        update = Clock.create_trigger(self.update_detail, 0.1)
+        self.ids['graph_container'].bind(scale=update, pos=update)
+        self.bind(size=update)
+    def update_detail(self, *args):
+        '''plots each graph at the level of detail for the x range that is on
+        screen'''
+        container = self.ids['graph_container']
+        graph = self.ids['graph']
+        view = container.parent
+        left = container.to_local(view.x, view.y)[0]
+        right = container.to_local(view.right, view.top)[0]
+        #view_pos and view_size are the plot area, without the axis labels
+        plot_left = graph.x + graph.view_pos[0]
+        per_pixel = (float(graph.xmax - graph.xmin) /
+                     max(graph.view_size[0], 1))
+        x_min = graph.xmin + (left - plot_left) * per_pixel
+        x_max = graph.xmin + (right - plot_left) * per_pixel
+        for pyramid, plot in zip(self._pyramids, self._plots):
+            plot.points = _plot_points(*pyramid.points(x_min, x_max,
+                                                       self.max_points))
     def make_graph(self):
         '''makes a graph and plots'''
         colors = itertools_cycle(self._color_list)
@@ -432,8 +463,9 @@ class PlotPopup(Popup):
                    300, 500, 1000, 2000, 5000]
         for text_pts in self._plot_list:
             color_ = next(colors)
-            self.ids['graph'].add_plot(MeshLinePlot(points=text_pts[1],
-                                                    color=color_))
+            plot = MeshLinePlot(points=text_pts[1], color=color_)
+            self._plots.append(plot)
+            self.ids['graph'].add_plot(plot)
         #get numbers for graph ticks
         x_tick_num = (self.x_range[1]-self.x_range[0])/9.
         for tick in x_ticks:
@@ -466,10 +498,10 @@ class PlotPopup(Popup):
     def make_legend(self):
         '''created the dropdown menu that's called by 'legend' button'''
         colors = itertools_cycle(self._color_list)
-        for text, pts in self._plot_list:
-            btn = ListButton(text=text, size_hint=(None, None),
-                             height=80, lst=pts, color=next(colors),
-                             valign='middle')
+        for (text, _), plot in zip(self._plot_list, self._plots):
+            btn = LegendButton(text=text, size_hint=(None, None),
+                               height=80, plot=plot, color=next(colors),
+                               valign='middle')
             btn.bind(on_release=self.legend.select)
             self.legend.add_widget(btn)
         self.legend.on_select = self.flash_plot
@@ -504,15 +536,11 @@ class PlotPopup(Popup):
             widths.append(btn.width)
         self.ids['legend'].width = max(widths)
     def flash_plot(self, btn, second_time=False, flash_time=0.5):
-        '''on press, highlight selected graph'''
-        for plot in self.ids['graph'].plots:
-            if plot.points == btn.lst:
-                #temp_color = [1, 1, 1, 1]
-                temp_color = [1-val for val in btn.color]
-                temp_color[3] = 1
-                self.ids['graph'].remove_plot(plot)
-                new_plot = MeshLinePlot(points=btn.lst, color=temp_color)
-                self.ids['graph'].add_plot(new_plot)
+        '''on press, highlight selected graph. only the plot's color changes,
+        so its points aren't drawn again.'''
+        temp_color = [1-val for val in btn.color]
+        temp_color[3] = 1
+        btn.plot.color = temp_color
         if second_time:
             Clock.schedule_once(
                 lambda dt: self._callback(btn, flash_time, second_time=True),
@@ -522,9 +550,7 @@ class PlotPopup(Popup):
                                 flash_time)
     def _callback(self, btn, flash_time, second_time=False):
         '''resets graph to original color'''
-        for plot in self.ids['graph'].plots:
-            if plot.points == btn.lst:
-                plot.color = btn.color
+        btn.plot.color = btn.color
         if not second_time:
             Clock.schedule_once(lambda dt: self.flash_plot(btn, True),
                                 flash_time)
@@ -533,7 +559,9 @@ class PlotPopup(Popup):
 class PlotCheckBox(BoxLayout):
     '''a checkbox with associated label and function to return label if box
     checked'''
-    tuple_list = ObjectProperty([(0, 1)])
+    #kivy compares a new value to the old one, and comparing a list to an
+    #fm.Frequencies from the history would read its frequencies from the file
+    tuple_list = ObjectProperty(None)
     text = StringProperty('')
     active = BooleanProperty(False)
     def __init__(self, reloader=True, **kwargs):
@@ -618,10 +646,11 @@ class GraphBox(BoxLayout):
             if isinstance(item, PlotCheckBox):
                 if item.active:
                     to_plot.append((item.text, item.tuple_list))
-        plots = self.view_model.graph_it(to_plot)
+        plots = self.view_model.graph_pyramids(to_plot)
         self.update()
         if plots[2]:
-            plotter = PlotPopup(*plots)
+            plotter = PlotPopup(*plots,
+                                max_points=self.view_model.max_points)
             plotter.open()
     def clear_all(self, btn):
         '''clear graph history'''
@@ -649,6 +678,7 @@ class StatBox(BoxLayout):
     view_model = ObjectProperty(mvm.StatBox(mvm.TableManager()))
     def __init__(self, **kwargs):
         super(StatBox, self).__init__(**kwargs)
+        self.show_percentiles = False
 
     def display_stats(self, stat_text, vals):
         '''takes a stat text and two values, and displays them.'''
@@ -664,7 +694,15 @@ class StatBox(BoxLayout):
         self.ids['info_text'].text = info_text
         self.ids['slider_1'].max = self.ids['slider_2'].max = min_max[1]
         self.ids['slider_1'].min = self.ids['slider_2'].min = min_max[0]
-        self.display_stats(stat_text, vals)
+        if self.show_percentiles:
+            self.assign_slider_value()
+        else:
+            self.display_stats(stat_text, vals)
+    def toggle_percentiles(self, show):
+        '''called by the percentiles button. switches between range stats and
+        percentiles.'''
+        self.show_percentiles = show
+        self.assign_slider_value()
     def assign_text_value(self):
         '''called by text_input to assign that value to sliders and
         show stats'''
@@ -676,7 +714,11 @@ class StatBox(BoxLayout):
         '''the main function. displays stats of current slider values.'''
         val_1 = int(self.ids['slider_1'].value)
         val_2 = int(self.ids['slider_2'].value)
-        self.display_stats(*self.view_model.display_stats(val_1, val_2))
+        if self.show_percentiles:
+            self.display_stats(*self.view_model.display_percentiles(val_1,
+                                                                    val_2))
+        else:
+            self.display_stats(*self.view_model.display_stats(val_1, val_2))
 
 
 ###############     InfoBox classes     ###############
@@ -766,8 +808,9 @@ class DicePlatform(Carousel):
         self.direction = 'right'
         self.loop = 'true'
         table = mvm.TableManager()
-        history = mvm.HistoryManager()
+        history = mvm.HistoryManager(write_delay=0.5)
         self._read_hist_msg = history.read_history()
+        self._history = history
         change = mvm.ChangeBox(table)
         add = mvm.AddBox(table)
         stat = mvm.StatBox(table)
@@ -795,6 +838,16 @@ class DicePlatform(Carousel):
                       'whatcha gonna do about it?  cry?\n\n')
         self.ids['change_box'].ids['intro'].text = header + INTRO_TEXT
 
+    def flush_history(self):
+        '''writes any graph history still waiting in the background. returns
+        'ok', or a msg that begins with "error" if it couldn't be written. a
+        disk error mustn't crash the app while it pauses or stops, and the
+        history is still pending for the next write.'''
+        try:
+            self._history.flush()
+        except Exception as error:  # pylint: disable=broad-except
+            return 'error: {}'.format(error)
+        return 'ok'
     def do_update(self):
         '''updates appropriate things for any die add or remove'''
         self.ids['change_box'].update()
@@ -811,8 +864,13 @@ class DiceCarouselApp(App):
         current_app = DicePlatform()
         return current_app
     def on_pause(self):
-        '''allows pausing on android'''
+        '''allows pausing on android. the app may be killed while paused, so
+        graph history is written first.'''
+        self.root.flush_history()
         return True
+    def on_stop(self):
+        '''writes graph history before closing'''
+        self.root.flush_history()
     def on_resume(self):
         '''required with on_pause()'''
         pass
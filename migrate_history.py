@@ -0,0 +1,36 @@
+'''converts history files of older formats to the current one without
+starting the app.
+
+    python migrate_history.py [--compress zlib|lzma] [FILE ...]
+
+with no FILE, the history file in the current directory is converted.'''
+from __future__ import print_function
+
+import argparse
+import sys
+
+import file_handler as fh
+
+
+def main(args=None):
+    '''migrates each file and prints how it went. returns 1 if any file
+    couldn't be migrated, else 0'''
+    parser = argparse.ArgumentParser(
+        description='converts dice history files to the current format')
+    parser.add_argument('files', nargs='*', default=[fh.HISTORY_FILE],
+                        metavar='FILE')
+    parser.add_argument('--compress', choices=sorted(fh._COMPRESSORS),
+                        default=None)
+    options = parser.parse_args(args)
+    failed = False
+    for file_name in options.files:
+        msg, errors = fh.migrate_history(file_name, options.compress)
+        print('{}: {}'.format(file_name, msg))
+        for index, error in errors:
+            print('    entry {}: {}'.format(index, error))
+        failed = failed or 'error:' in msg
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+'''numpy tools for the points of a graph. pts are numpy arrays: [x array,
+y array] for axes, or an array of [x, y] rows for pts, as in
+dt_gui_mvm._graph_pts.'''
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+import numpy as np
+
+#about two points for each pixel across a phone screen
+MAX_POINTS = 1000
+
+def downsample(x_vals, y_vals, max_points):
+    '''min/max bucketing. returns the indices, in order, of at most
+    max_points (but at least 4) of the points. the first and last points are
+    kept, the rest are split into buckets of about the same size, and the
+    lowest and highest point of each bucket are kept. so the x range, the
+    peak and the lowest point stay exact and the shape of each bucket stays
+    on the graph.'''
+    size = len(x_vals)
+    if size <= max(max_points, 4):
+        return np.arange(size)
+    buckets = max(1, (max_points - 2) // 2)
+    inside = np.arange(1, size - 1)
+    bucket_ids = inside * buckets // (size - 1)
+    order = np.lexsort((np.asarray(y_vals)[inside], bucket_ids))
+    sizes = np.bincount(bucket_ids)
+    ends = np.cumsum(sizes[sizes > 0])
+    starts = ends - sizes[sizes > 0]
+    return np.unique(np.concatenate(
+        ([0, size - 1], inside[order[starts]], inside[order[ends - 1]])))
+
+def downsample_pts(pts, max_points, use_axes):
+    '''pts with at most max_points points, see downsample. the pts come back
+    as numpy arrays: [x array, y array] with use_axes, else an array of
+    [x, y] rows. pts with few enough points are returned as they are.'''
+    if use_axes:
+        x_vals, y_vals = pts
+    else:
+        x_vals, y_vals = np.asarray(pts).T
+    if max_points is None or len(x_vals) <= max_points:
+        return pts
+    keep = downsample(x_vals, y_vals, max_points)
+    if use_axes:
+        return [np.asarray(x_vals)[keep], np.asarray(y_vals)[keep]]
+    return np.asarray(pts)[keep]
+
+class DetailPyramid(object):
+    '''the points of a graph at several levels of detail. level 0 is every
+    point, and each level after has about half the points of the one before
+    it (see downsample), down to min_points. so every level keeps the exact
+    x range, peak and lowest point. the levels are kept end to end in rows, a
+    read-only array of [x, y] rows, where rows[bounds[n]:bounds[n + 1]] is
+    level n.'''
+    def __init__(self, x_vals, y_vals, min_points=256):
+        levels = [(np.asarray(x_vals, dtype=np.float64),
+                   np.asarray(y_vals, dtype=np.float64))]
+        while len(levels[-1][0]) > max(min_points, 4):
+            x_vals, y_vals = levels[-1]
+            keep = downsample(x_vals, y_vals, len(x_vals) // 2)
+            levels.append((x_vals[keep], y_vals[keep]))
+        self.bounds = tuple(np.cumsum(
+            [0] + [len(x_vals) for x_vals, _ in levels]).tolist())
+        self.rows = np.concatenate([np.column_stack(level)
+                                    for level in levels])
+        self.rows.flags.writeable = False
+    @property
+    def levels(self):
+        '''[(x array, y array), ...] of each level. they are views of rows'''
+        return [(self.rows[start:stop, 0], self.rows[start:stop, 1])
+                for start, stop in zip(self.bounds, self.bounds[1:])]
+    def ranges(self):
+        '''((x min, x max), (y min, y max)) of the points. every level has
+        them, so they come from the least detailed one.'''
+        x_vals, y_vals = self.levels[-1]
+        return ((float(x_vals[0]), float(x_vals[-1])),
+                (float(y_vals.min()), float(y_vals.max())))
+    def level_for(self, x_min, x_max, max_points):
+        '''the most detailed level with at most max_points points from x_min
+        to x_max, or the least detailed level if none do. level 0 if
+        max_points is None.'''
+        levels = self.levels
+        if max_points is None:
+            return 0
+        for level, (x_vals, _) in enumerate(levels):
+            visible = (np.searchsorted(x_vals, x_max, side='right') -
+                       np.searchsorted(x_vals, x_min, side='left'))
+            if visible <= max_points:
+                return level
+        return len(levels) - 1
+    def points(self, x_min, x_max, max_points=MAX_POINTS):
+        '''(x array, y array) with the points from x_min to x_max at
+        level_for(x_min, x_max, max_points) and the rest at the least
+        detailed level. the points just outside x_min and x_max are at the
+        chosen level too, so the line goes all the way to the edges.'''
+        level = self.level_for(x_min, x_max, max_points)
+        levels = self.levels
+        coarse_x, coarse_y = levels[-1]
+        x_vals, y_vals = levels[level]
+        start = max(np.searchsorted(x_vals, x_min, side='left') - 1, 0)
+        stop = np.searchsorted(x_vals, x_max, side='right') + 1
+        before = np.searchsorted(coarse_x, x_vals[start], side='left')
+        after = np.searchsorted(coarse_x, x_vals[min(stop, len(x_vals)) - 1],
+                                side='right')
+        return (np.concatenate((coarse_x[:before], x_vals[start:stop],
+                                coarse_x[after:])),
+                np.concatenate((coarse_y[:before], y_vals[start:stop],
+                                coarse_y[after:])))
+
+class PyramidCache(object):
+    '''a least recently used cache of DetailPyramids, like an
+    fm.FrequencyCache. the oldest are thrown out when their rows use more
+    than max_bytes.'''
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._store = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+    def __len__(self):
+        return len(self._store)
+    def __contains__(self, key):
+        return key in self._store
+    def _trim(self):
+        '''removes the least recently used until under max_bytes'''
+        while self._bytes > self._max_bytes:
+            _, pyramid = self._store.popitem(last=False)
+            self._bytes -= pyramid.rows.nbytes
+    def set_max_bytes(self, max_bytes):
+        '''changes the memory budget, throwing out what doesn't fit'''
+        self._max_bytes = max_bytes
+        self._trim()
+    def get(self, key):
+        '''returns the DetailPyramid or None if key isn't there'''
+        if key not in self._store:
+            self._misses += 1
+            return None
+        self._hits += 1
+        pyramid = self._store.pop(key)
+        self._store[key] = pyramid
+        return pyramid
+    def put(self, key, pyramid):
+        '''stores pyramid. pyramids bigger than max_bytes are not stored.'''
+        if key in self._store:
+            self._bytes -= self._store.pop(key).rows.nbytes
+        if pyramid.rows.nbytes <= self._max_bytes:
+            self._store[key] = pyramid
+            self._bytes += pyramid.rows.nbytes
+            self._trim()
+    def clear(self):
+        '''empties the cache and resets hits and misses'''
+        self._store = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+    def info(self):
+        '''returns a dict of hits, misses, entries, bytes and max_bytes'''
+        return {'hits': self._hits, 'misses': self._misses,
+                'entries': len(self._store), 'bytes': self._bytes,
+                'max_bytes': self._max_bytes}
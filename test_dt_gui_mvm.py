@@ -4,11 +4,28 @@
 
 from __future__ import absolute_import
 
+import os
+import time
 import unittest
 
 import numpy as np
 import dicetables as dt
 import dt_gui_mvm as mvm
+import freq_math as fm
+import file_handler as fh
+
+def plain(value):
+    '''value with numpy arrays, tuples and lists all as lists, so pts compare
+    the same whatever they are made of'''
+    if isinstance(value, dict):
+        return dict((key, plain(val)) for key, val in value.items())
+    if isinstance(value, fm.Frequencies):
+        value = value.tuple_list()
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [plain(val) for val in value]
+    return value
 
 class DummyParent(object):
     def __init__(self):
@@ -32,7 +49,14 @@ class TestMVM(unittest.TestCase):
         self.SB = mvm.StatBox(self.TM)
         self.AB = mvm.AddBox(self.TM)
         self.IB = mvm.InfoBox(DummyParent())
+        mvm.TABLE_CACHE.clear()
+        mvm.POWER_CACHE.clear()
+        mvm.PTS_CACHE.clear()
+        mvm.PYRAMID_CACHE.clear()
+    def assertPlainEqual(self, first, second):
+        self.assertEqual(plain(first), plain(second))
     def tearDown(self):
+        fh.clear_journal()
         del self.TM
         del self.HM
         del self.GB
@@ -65,6 +89,67 @@ class TestMVM(unittest.TestCase):
         self.assertEqual(self.TM.request_info('full_text'), '0: 1\n')
     def test_table_manager_request_info_tuple_list(self):
         self.assertEqual(self.TM.request_info('tuple_list'), [(0, 1)])
+    def test_table_manager_request_info_only_calculates_once(self):
+        self.TM.request_add(1, dt.Die(3))
+        self.TM.request_info('mean')
+        self.TM.request_info('mean')
+        self.TM.request_info('mean')
+        self.assertEqual(self.TM.request_cache_info()['mean'],
+                         (2, 1, 2/3.))
+    def test_table_manager_request_info_text_one_line_uses_cached_text(self):
+        self.TM.request_info('text')
+        self.TM.request_info('text_one_line')
+        self.assertEqual(self.TM.request_cache_info()['text'][:2], (1, 1))
+    def test_table_manager_request_cache_info_only_has_requested_keys(self):
+        self.TM.request_info('range')
+        self.assertEqual(self.TM.request_cache_info(), {'range': (0, 1, 0.0)})
+    def test_table_manager_request_info_cache_invalidated_by_add(self):
+        self.assertEqual(self.TM.request_info('range'), (0, 0))
+        self.TM.request_add(2, dt.Die(3))
+        self.assertEqual(self.TM.request_info('range'), (2, 6))
+    def test_table_manager_request_info_cache_invalidated_by_remove(self):
+        self.TM.request_add(2, dt.Die(3))
+        self.assertEqual(self.TM.request_info('text'), '2D3')
+        self.TM.request_remove(1, dt.Die(3))
+        self.assertEqual(self.TM.request_info('text'), '1D3')
+    def test_table_manager_request_info_cache_invalidated_by_reset(self):
+        self.TM.request_add(2, dt.Die(3))
+        self.assertEqual(self.TM.request_info('mean'), 4.0)
+        self.TM.request_reset()
+        self.assertEqual(self.TM.request_info('mean'), 0.0)
+    def test_table_manager_request_info_cache_invalidated_by_reload(self):
+        self.TM.request_add(1, dt.Die(2))
+        obj = self.TM.request_plot_obj(True)
+        self.TM.request_add(1, dt.Die(2))
+        self.assertEqual(self.TM.request_info('text_one_line'), '2D2')
+        self.TM.request_reload(obj)
+        self.assertEqual(self.TM.request_info('text_one_line'), '1D2')
+    def test_table_manager_request_info_frequencies(self):
+        self.TM.request_add(2, dt.Die(2))
+        frequencies = self.TM.request_info('frequencies')
+        self.assertIsInstance(frequencies, fm.Frequencies)
+        self.assertEqual((frequencies.offset, frequencies.array.tolist()),
+                         (2, [1, 2, 1]))
+    def test_table_manager_request_info_frequencies_on_reset(self):
+        self.TM.request_add(2, dt.Die(2))
+        self.TM.request_reset()
+        self.assertEqual(self.TM.request_info('frequencies'), [(0, 1)])
+    def test_table_manager_request_plot_obj_tuple_list_is_frequencies(self):
+        self.TM.request_add(2, dt.Die(2))
+        self.assertIsInstance(self.TM.request_plot_obj(True)['tuple_list'],
+                              fm.Frequencies)
+    def test_table_manager_request_reload_legacy_tuple_list(self):
+        plot_obj = {'dice': [(dt.Die(2), 2)],
+                    'tuple_list': [(2, 1), (3, 2), (4, 1)]}
+        self.TM.request_reload(plot_obj)
+        self.assertEqual(self.TM.request_info('frequencies'),
+                         fm.Frequencies(2, np.array([1, 2, 1])))
+    def test_table_manager_request_info_mutate_list_wont_mutate_cache(self):
+        self.TM.request_add(1, dt.Die(2))
+        self.TM.request_info('tuple_list').append(5)
+        self.TM.request_info('dice_list').append(5)
+        self.assertEqual(self.TM.request_info('tuple_list'), [(1, 1), (2, 1)])
+        self.assertEqual(self.TM.request_info('dice_list'), [(dt.Die(2), 1)])
     def test_table_manager_request_stats_true_zero_chance(self):
         self.assertEqual(self.TM.request_stats([1, 2, 3]),
                          ('1-3', '0.0', '1', 'infinity', '0.0'))
@@ -75,6 +160,57 @@ class TestMVM(unittest.TestCase):
     def test_table_manager_request_stats_normal_case(self):
         self.assertEqual(self.TM.request_stats([0]),
                          ('0', '1', '1', '1.000', '100.0'))
+    def test_table_manager_request_stats_range_matches_request_stats(self):
+        self.TM.request_add(2, dt.ModWeightedDie({1: 2, 4: 10**30}, -3))
+        self.TM.request_add(3, dt.Die(3))
+        for val_1, val_2 in [(-20, 20), (5, -1), (-3, -3), (3, 4), (0, 0),
+                             (-100, -50), (100, 50)]:
+            start, stop = min(val_1, val_2), max(val_1, val_2)
+            self.assertEqual(
+                self.TM.request_stats_range(val_1, val_2),
+                self.TM.request_stats(list(range(start, stop + 1))))
+    def test_table_manager_request_stats_range_tiny_tiny_chance(self):
+        self.TM.request_add(1, dt.WeightedDie({1:1, 2:10**1000}))
+        self.assertEqual(self.TM.request_stats_range(1, 1),
+                         ('1', '1', '1.000e+1000', '1.000e+1000', '1.000e-998'))
+    def test_table_manager_request_stats_range_makes_index_once(self):
+        self.TM.request_add(3, dt.Die(6))
+        self.TM.request_stats_range(3, 5)
+        self.TM.request_stats_range(4, 10)
+        self.assertEqual(self.TM.request_cache_info()['running_total'][:2],
+                         (1, 1))
+    def test_table_manager_request_stats_range_new_index_after_add(self):
+        self.TM.request_add(1, dt.Die(2))
+        self.assertEqual(self.TM.request_stats_range(1, 2)[1], '2')
+        self.TM.request_add(1, dt.Die(2))
+        self.assertEqual(self.TM.request_stats_range(2, 3)[1], '3')
+    def test_table_manager_request_quantiles(self):
+        self.TM.request_add(2, dt.Die(6))
+        self.assertEqual(self.TM.request_quantiles([0, 1/36., 0.5, 1]),
+                         [2, 2, 7, 12])
+    def test_table_manager_request_quantiles_exact_at_edges(self):
+        self.TM.request_add(1, dt.Die(4))
+        self.assertEqual(self.TM.request_quantiles([0.25, 0.2500001, 0.75]),
+                         [1, 2, 3])
+    def test_table_manager_request_quantiles_big_numbers(self):
+        self.TM.request_add(1, dt.WeightedDie({1: 1, 2: 10**400}))
+        self.TM.request_add(1, dt.Die(2))
+        self.assertEqual(self.TM.request_quantiles([1e-300, 0.5, 1]),
+                         [3, 3, 4])
+    def test_table_manager_request_quantiles_bad_fraction_raises_error(self):
+        self.assertRaises(ValueError, self.TM.request_quantiles, [1.5])
+        self.assertRaises(ValueError, self.TM.request_quantiles, [-0.1])
+    def test_table_manager_request_percentiles(self):
+        self.TM.request_add(1, dt.Die(10))
+        self.assertEqual(self.TM.request_percentiles([10, 55, 90, 100]),
+                         [1, 6, 9, 10])
+    def test_table_manager_request_tail_probabilities(self):
+        self.TM.request_add(2, dt.Die(6))
+        self.assertEqual(self.TM.request_tail_probabilities([1, 12, 13, 7]),
+                         [1.0, 1/36., 0.0, 21/36.])
+        self.assertEqual(
+            self.TM.request_tail_probabilities([1, 2, 12], upper=False),
+            [0.0, 1/36., 1.0])
     def test_table_manager_request_plot_obj_use_axes(self):
         self.TM.request_add(1, dt.Die(2))
         self.TM.request_add(1, dt.Die(4))
@@ -83,7 +219,13 @@ class TestMVM(unittest.TestCase):
                     'dice': [(dt.Die(2), 1), (dt.Die(4), 1)],
                     'tuple_list': [(2, 1), (3, 2), (4, 2), (5, 2), (6, 1)],
                     'pts': [(2, 3, 4, 5, 6), (12.5, 25.0, 25.0, 25.0, 12.5)]}
-        self.assertEqual(self.TM.request_plot_obj(True), plot_obj)
+        self.assertPlainEqual(self.TM.request_plot_obj(True), plot_obj)
+    def test_table_manager_request_plot_obj_passes_check_data(self):
+        self.TM.request_add(3, dt.Die(6))
+        self.assertEqual(fh.check_data(self.TM.request_plot_obj(True)), 'ok')
+        self.assertEqual(fh.check_data(self.TM.request_plot_obj(False)), 'ok')
+        fh.write_history_np(np.array([self.TM.request_plot_obj(False)]))
+        self.assertEqual(fh.read_history_np()[0], 'ok')
     def test_table_manager_request_plot_obj_not_use_axes(self):
         self.TM.request_add(1, dt.Die(2))
         self.TM.request_add(1, dt.Die(4))
@@ -93,7 +235,7 @@ class TestMVM(unittest.TestCase):
                     'tuple_list': [(2, 1), (3, 2), (4, 2), (5, 2), (6, 1)],
                     'pts': [(2, 12.5), (3, 25.0), (4, 25.0),
                             (5, 25.0), (6, 12.5)]}
-        self.assertEqual(self.TM.request_plot_obj(False), plot_obj)
+        self.assertPlainEqual(self.TM.request_plot_obj(False), plot_obj)
     def test_table_manager_request_reload(self):
         plot_obj = {'text': '1D2 \\ 1D4', 'x_range': (2, 6),
                     'y_range': (12.5, 25.0),
@@ -104,12 +246,125 @@ class TestMVM(unittest.TestCase):
         self.assertEqual(self.TM.request_info('text'), '1D2\n1D4')
         self.assertEqual(self.TM.request_info('full_text'),
                          '2: 1\n3: 2\n4: 2\n5: 2\n6: 1\n')
+    def test_table_manager_request_reload_large_table(self):
+        self.TM.request_add(40, dt.Die(100))
+        self.TM.request_add(2, dt.ModWeightedDie({1: 10**20, 2: 1}, -3))
+        obj = self.TM.request_plot_obj(True)
+        self.TM.request_reset()
+        self.TM.request_reload(obj)
+        self.assertPlainEqual(self.TM.request_plot_obj(True), obj)
+        self.TM.request_remove(1, dt.Die(100))
+        self.assertEqual(self.TM.request_info('dice_list'),
+                         [(dt.ModWeightedDie({1: 10**20, 2: 1}, -3), 2),
+                          (dt.Die(100), 39)])
+    def test_table_manager_request_reload_mismatch_raises_error(self):
+        self.TM.request_add(1, dt.Die(2))
+        mvm.TABLE_CACHE.clear()
+        plot_obj = {'dice': [(dt.Die(2), 1)], 'tuple_list': [(1, 1), (2, 2)]}
+        self.assertRaises(ValueError, self.TM.request_reload, plot_obj)
+        plot_obj = {'dice': [(dt.Die(2), 1)], 'tuple_list': [(1, 1), (3, 1)]}
+        self.assertRaises(ValueError, self.TM.request_reload, plot_obj)
+        self.assertEqual(self.TM.request_info('tuple_list'), [(1, 1), (2, 1)])
+    def test_table_manager_request_reload_uses_table_cache(self):
+        self.TM.request_add(1, dt.Die(2))
+        plot_obj = {'dice': [(dt.Die(2), 1)], 'tuple_list': [(1, 1), (2, 2)]}
+        self.TM.request_reset()
+        self.TM.request_reload(plot_obj)
+        self.assertEqual(self.TM.request_info('tuple_list'), [(1, 1), (2, 1)])
+    def test_table_manager_request_reload_doesnt_add_to_table_cache(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        tuple_list = table.frequency_all()
+        tuple_list[7] = (tuple_list[7][0], tuple_list[7][1] + 1)
+        tuple_list[8] = (tuple_list[8][0], tuple_list[8][1] - 1)
+        self.TM.request_reload({'dice': [(dt.Die(6), 3)],
+                                'tuple_list': tuple_list})
+        self.TM.request_add(2, dt.Die(6))
+        self.TM.request_add(1, dt.Die(6))
+        self.assertEqual(mvm.TABLE_CACHE.info()['entries'], 0)
+        for number in (3, 5, 6):
+            table = dt.DiceTable()
+            table.add_die(number, dt.Die(6))
+            other = mvm.TableManager()
+            other.request_add(number, dt.Die(6))
+            self.assertEqual(other.request_info('tuple_list'),
+                             table.frequency_all())
+    def test_table_manager_add_remove_add_uses_table_cache(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        self.TM.request_add(3, dt.Die(6))
+        self.TM.request_remove(3, dt.Die(6))
+        self.TM.request_add(3, dt.Die(6))
+        info = mvm.TABLE_CACHE.info()
+        self.assertEqual((info['hits'], info['entries']), (1, 2))
+        self.assertEqual(self.TM.request_info('tuple_list'),
+                         table.frequency_all())
+    def test_table_manager_table_cache_key_is_canonical(self):
+        self.TM.request_add(1, dt.Die(2))
+        self.TM.request_add(1, dt.Die(3))
+        other = mvm.TableManager()
+        other.request_add(1, dt.Die(3))
+        other.request_add(1, dt.Die(2))
+        self.assertEqual(mvm.TABLE_CACHE.info()['hits'], 1)
+        self.assertEqual(other.request_info('tuple_list'),
+                         self.TM.request_info('tuple_list'))
+    def test_table_manager_add_puts_die_power_in_power_cache(self):
+        self.TM.request_add(3, dt.Die(2))
+        self.TM.request_add(2, dt.Die(4))
+        self.assertEqual(len(mvm.POWER_CACHE), 2)
+        offset, array = mvm.POWER_CACHE.get((repr(dt.Die(4)), 2))
+        self.assertEqual((offset, array.tolist()), (2, [1, 2, 3, 4, 3, 2, 1]))
+    def test_table_manager_power_cache_follows_adds(self):
+        self.TM.request_add(1, dt.Die(3))
+        self.TM.request_add(1, dt.Die(2))
+        self.TM.request_add(1, dt.Die(2))
+        offset, array = mvm.POWER_CACHE.get((repr(dt.Die(2)), 2))
+        self.assertEqual((offset, array.tolist()), (2, [1, 2, 1]))
+    def test_table_manager_big_removal_uses_cached_pieces(self):
+        table = dt.DiceTable()
+        for number, die in [(60, dt.Die(6)), (20, dt.Die(20)),
+                            (5, dt.ModDie(10, 3))]:
+            self.TM.request_add(number, die)
+            table.add_die(number, die)
+        self.TM.request_remove(15, dt.Die(20))
+        table.remove_die(15, dt.Die(20))
+        rest_key = mvm._dice_key([(dt.Die(6), 60), (dt.ModDie(10, 3), 5)])
+        self.assertIn(rest_key, mvm.TABLE_CACHE)
+        self.assertIn((repr(dt.Die(20)), 5), mvm.POWER_CACHE)
+        self.assertEqual(self.TM.request_info('tuple_list'),
+                         table.frequency_all())
+        self.TM.request_remove(55, dt.Die(6))
+        table.remove_die(55, dt.Die(6))
+        self.assertEqual(self.TM.request_info('tuple_list'),
+                         table.frequency_all())
     def test_table_manager_request_add(self):
         self.TM.request_add(1, dt.Die(2))
         self.TM.request_add(1, dt.Die(4))
         self.assertEqual(self.TM.request_info('text'), '1D2\n1D4')
         self.assertEqual(self.TM.request_info('full_text'),
                          '2: 1\n3: 2\n4: 2\n5: 2\n6: 1\n')
+    def test_table_manager_request_add_zero_does_nothing(self):
+        self.TM.request_add(1, dt.Die(2))
+        self.TM.request_add(0, dt.Die(4))
+        self.assertEqual(self.TM.request_info('dice_list'), [(dt.Die(2), 1)])
+        self.assertEqual(self.TM.request_info('tuple_list'), [(1, 1), (2, 1)])
+    def test_table_manager_request_add_negative_raises_error(self):
+        self.assertRaises(ValueError, self.TM.request_add, -1, dt.Die(4))
+    def test_table_manager_request_add_same_die_adds_to_dice_list(self):
+        self.TM.request_add(1, dt.Die(2))
+        self.TM.request_add(2, dt.Die(2))
+        self.assertEqual(self.TM.request_info('dice_list'), [(dt.Die(2), 3)])
+    def test_table_manager_request_add_large_matches_dicetables(self):
+        table = dt.DiceTable()
+        for number, die in [(2, dt.ModDie(3, -2)), (30, dt.Die(20)),
+                            (3, dt.WeightedDie({1: 10**30, 3: 1}))]:
+            table.add_die(number, die)
+            self.TM.request_add(number, die)
+        self.assertEqual(self.TM.request_info('tuple_list'),
+                         table.frequency_all())
+        self.assertEqual(self.TM.request_info('full_text'),
+                         dt.full_table_string(table))
+        self.assertEqual(self.TM.request_info('stddev'), table.stddev())
     def test_table_manager_request_remove_normal_case(self):
         self.TM.request_add(1, dt.Die(2))
         self.TM.request_add(1, dt.Die(4))
@@ -127,6 +382,17 @@ class TestMVM(unittest.TestCase):
         self.TM.request_remove(1, dt.Die(4))
         self.assertEqual(self.TM.request_info('text'), '1D2')
         self.assertEqual(self.TM.request_info('tuple_list'), [(1, 1), (2, 1)])
+    def test_table_manager_request_remove_large_matches_dicetables(self):
+        table = dt.DiceTable()
+        for number, die in [(100, dt.Die(100)), (3, dt.ModDie(4, -2))]:
+            table.add_die(number, die)
+            self.TM.request_add(number, die)
+        for number, die in [(5, dt.Die(100)), (2, dt.ModDie(4, -2))]:
+            table.remove_die(number, die)
+            self.TM.request_remove(number, die)
+        self.assertEqual(self.TM.request_info('tuple_list'),
+                         table.frequency_all())
+        self.assertEqual(self.TM.request_info('text'), str(table))
     def test_table_manager_request_reset(self):
         self.TM.request_add(1, dt.Die(2))
         self.TM.request_reset()
@@ -134,28 +400,30 @@ class TestMVM(unittest.TestCase):
         self.assertEqual(self.TM.request_info('tuple_list'), [(0, 1)])
 
     def test_history_manager_inits_as_empty(self):
-        self.assertEqual(self.HM._history.size, 0)
+        self.assertEqual(len(self.HM._history), 0)
     def test_history_manager_adds_plot_obj(self):
         self.TM.request_add(1, dt.Die(2))
         obj = self.TM.request_plot_obj(True)
         self.HM.add_plot_obj(obj)
-        self.assertEqual(self.HM._history[0], obj)
+        self.assertEqual(list(self.HM._history.values())[0],
+                         fh.without_pts(obj))
     def test_history_manager_wont_add_empty_plot_obj(self):
         empty_obj = self.TM.request_plot_obj(True)
         self.HM.add_plot_obj(empty_obj)
-        self.assertEqual(self.HM._history.size, 0)
+        self.assertEqual(len(self.HM._history), 0)
     def test_history_manager_add_plot_obj__wont_add_duplicates(self):
         self.TM.request_add(1, dt.Die(2))
         obj = self.TM.request_plot_obj(True)
         self.HM.add_plot_obj(obj)
         self.HM.add_plot_obj(obj)
-        self.assertEqual(self.HM._history.size, 1)
-        self.assertEqual(self.HM._history[0], obj)
+        self.assertEqual(len(self.HM._history), 1)
+        self.assertEqual(list(self.HM._history.values())[0],
+                         fh.without_pts(obj))
     def test_history_manager_get_obj_returns_obj(self):
         self.TM.request_add(1, dt.Die(2))
         obj = self.TM.request_plot_obj(True)
         self.HM.add_plot_obj(obj)
-        self.assertEqual(self.HM.get_obj('1D2', [(1, 1), (2, 1)]), obj)
+        self.assertPlainEqual(self.HM.get_obj('1D2', [(1, 1), (2, 1)]), obj)
     def test_history_manager_get_obj_returns_empty_if_not_pts(self):
         self.TM.request_add(1, dt.Die(2))
         obj = self.TM.request_plot_obj(True)
@@ -177,11 +445,68 @@ class TestMVM(unittest.TestCase):
                     'x_range': (1, 2),
                     'y_range': (50.0, 50.0)}
         for key in from_tst.keys():
-            if key in ['dice', 'tuple_list', 'pts']:
+            if key in ['dice', 'pts']:
                 from_tst[key].append(5)
+            elif key == 'tuple_list':
+                self.assertRaises(ValueError, from_tst[key].array.__setitem__,
+                                  0, 5)
             else:
                 from_tst[key] = ''
-        self.assertEqual(self.HM.get_obj('1D2', [(1, 1), (2, 1)]), expected)
+        self.assertPlainEqual(self.HM.get_obj('1D2', [(1, 1), (2, 1)]),
+                              expected)
+    def test_history_manager_get_obj_with_frequencies(self):
+        self.TM.request_add(1, dt.Die(2))
+        obj = self.TM.request_plot_obj(True)
+        self.HM.add_plot_obj(obj)
+        frequencies = fm.Frequencies(1, np.array([1, 1]))
+        self.assertPlainEqual(self.HM.get_obj('1D2', frequencies), obj)
+    def test_history_manager_get_obj_nonsense_tuple_list_returns_empty(self):
+        self.TM.request_add(1, dt.Die(2))
+        self.HM.add_plot_obj(self.TM.request_plot_obj(True))
+        self.assertEqual(self.HM.get_obj('1D2', []), {})
+        self.assertEqual(self.HM.get_obj('1D2', 'abc'), {})
+    def test_history_manager_index_follows_history(self):
+        objs = []
+        for _ in range(4):
+            self.TM.request_add(1, dt.Die(3))
+            objs.append(self.TM.request_plot_obj(True))
+            self.HM.add_plot_obj(objs[-1])
+        self.HM.clear_selected([objs[0], objs[2]])
+        self.assertPlainEqual(self.HM.get_obj('2D3', objs[1]['tuple_list']),
+                              objs[1])
+        self.assertPlainEqual(self.HM.get_obj('4D3', objs[3]['tuple_list']),
+                              objs[3])
+        self.assertEqual(self.HM.get_obj('1D3', objs[0]['tuple_list']), {})
+        self.assertEqual(self.HM.get_labels(),
+                         [('2D3', objs[1]['tuple_list']),
+                          ('4D3', objs[3]['tuple_list'])])
+    def test_history_manager_same_text_different_tuple_list(self):
+        self.TM.request_add(1, dt.Die(2))
+        obj_1 = self.TM.request_plot_obj(True)
+        obj_2 = dict(obj_1, tuple_list=[(1, 1), (2, 3)])
+        self.HM.add_plot_obj(obj_1)
+        self.HM.add_plot_obj(obj_2)
+        self.assertEqual(len(self.HM._history), 2)
+        self.assertPlainEqual(self.HM.get_obj('1D2', [(1, 1), (2, 3)]),
+                              dict(obj_2, pts=[(1, 2), (25.0, 75.0)]))
+    def test_history_manager_keeps_order_after_clear_selected(self):
+        objs = []
+        for _ in range(5):
+            self.TM.request_add(1, dt.Die(4))
+            objs.append(self.TM.request_plot_obj(True))
+            self.HM.add_plot_obj(objs[-1])
+        self.HM.clear_selected([objs[3], objs[0]])
+        self.HM.add_plot_obj(objs[0])
+        self.assertEqual([text for text, _ in self.HM.get_labels()],
+                         ['2D4', '3D4', '5D4', '1D4'])
+    def test_history_manager_clear_all_clears_index(self):
+        self.TM.request_add(1, dt.Die(2))
+        obj = self.TM.request_plot_obj(True)
+        self.HM.add_plot_obj(obj)
+        self.HM.clear_all()
+        self.assertEqual(self.HM.get_obj('1D2', [(1, 1), (2, 1)]), {})
+        self.HM.add_plot_obj(obj)
+        self.assertPlainEqual(self.HM.get_obj('1D2', [(1, 1), (2, 1)]), obj)
     def test_history_manager_get_labels_returns_empty_for_empty_hist(self):
         self.assertEqual(self.HM.get_labels(), [])
     def test_history_manager_get_labels_returns_as_expected(self):
@@ -225,9 +550,25 @@ class TestMVM(unittest.TestCase):
         obj = self.TM.request_plot_obj(True)
         self.HM.add_plot_obj(obj)
         self.HM.write_history()
-        history = np.load('numpy_history.npy')
-        self.assertEqual(history[0], obj)
+        history = fh.read_history_np()[1]
+        self.assertEqual(history[0], fh.without_pts(obj))
         self.assertEqual(history.size, 1)
+    def test_history_manager_write_history_is_object_array_in_order(self):
+        objs = []
+        for _ in range(3):
+            self.TM.request_add(1, dt.Die(2))
+            objs.append(self.TM.request_plot_obj(True))
+            self.HM.add_plot_obj(objs[-1])
+        self.HM.clear_selected([objs[1]])
+        self.HM.write_history()
+        history = fh.read_history_np()[1]
+        self.assertEqual(history.dtype, np.dtype('O'))
+        self.assertEqual(history.tolist(),
+                         [fh.without_pts(objs[0]), fh.without_pts(objs[2])])
+    def test_history_manager_write_empty_history(self):
+        self.HM.write_history()
+        history = fh.read_history_np()[1]
+        self.assertEqual((history.dtype, history.size), (np.dtype('O'), 0))
     def test_history_manager_read_history(self):
         self.TM.request_add(1, dt.Die(1))
         obj = self.TM.request_plot_obj(True)
@@ -237,6 +578,237 @@ class TestMVM(unittest.TestCase):
         msg = to_test.read_history()
         self.assertEqual(msg, 'ok')
         self.assertEqual(self.HM.get_labels(), [('1D1', [(1, 1)])])
+    def add_objs(self, history, number):
+        objs = []
+        for _ in range(number):
+            self.TM.request_add(1, dt.Die(3))
+            objs.append(self.TM.request_plot_obj(True))
+            history.add_plot_obj(objs[-1])
+        return objs
+    def test_history_manager_get_graphs_pts_are_shared_read_only_views(self):
+        self.add_objs(self.HM, 3)
+        first = self.HM.get_graphs()[2]
+        second = self.HM.get_graphs()[2]
+        for (_, pts_1), (_, pts_2) in zip(first, second):
+            for column_1, column_2 in zip(pts_1, pts_2):
+                self.assertFalse(column_1.flags.writeable)
+                self.assertTrue(np.shares_memory(column_1, column_2))
+        obj = self.HM.get_obj(first[0][0], self.HM.get_labels()[0][1])
+        self.assertTrue(np.shares_memory(obj['pts'][1], first[0][1][1]))
+    def test_history_manager_get_graphs_ranges_follow_changes(self):
+        objs = self.add_objs(self.HM, 3)
+        def ranges(objs):
+            return ((min(obj['x_range'][0] for obj in objs),
+                     max(obj['x_range'][1] for obj in objs)),
+                    (min(obj['y_range'][0] for obj in objs),
+                     max(obj['y_range'][1] for obj in objs)))
+        self.assertEqual(self.HM.get_graphs()[:2], ranges(objs))
+        self.HM.clear_selected([objs[0]])
+        self.assertEqual(self.HM.get_graphs()[:2], ranges(objs[1:]))
+        self.HM.clear_all()
+        self.HM.add_plot_obj(objs[0])
+        self.assertEqual(self.HM.get_graphs()[:2], ranges(objs[:1]))
+    def test_history_manager_write_history_appends_to_journal(self):
+        self.HM.write_history()
+        objs = self.add_objs(self.HM, 2)
+        self.HM.write_history()
+        self.HM.clear_selected([objs[0]])
+        self.HM.write_history()
+        records = fh.read_journal()
+        self.assertEqual([action for action, _ in records],
+                         ['add', 'add', 'remove'])
+        self.assertEqual(fh.read_history_np()[1].size, 0)
+    def test_history_manager_read_history_replays_journal(self):
+        self.HM.write_history()
+        objs = self.add_objs(self.HM, 3)
+        self.HM.write_history()
+        self.HM.clear_selected([objs[1]])
+        self.HM.write_history()
+        history = mvm.HistoryManager()
+        self.assertEqual(history.read_history(), 'ok: no history')
+        self.assertEqual(history.get_labels(), self.HM.get_labels())
+    def test_history_manager_read_history_journal_and_no_file(self):
+        self.HM.write_history()
+        self.add_objs(self.HM, 1)
+        self.HM.write_history()
+        os.remove('numpy_history.npy')
+        history = mvm.HistoryManager()
+        self.assertEqual(history.read_history(), 'ok')
+        self.assertEqual(history.get_labels(), self.HM.get_labels())
+    def test_history_manager_write_history_compacts_long_journal(self):
+        history = mvm.HistoryManager(compact_after=3)
+        history.write_history()
+        self.add_objs(history, 3)
+        history.write_history()
+        self.assertEqual(len(fh.read_journal()), 3)
+        self.add_objs(history, 1)
+        history.write_history()
+        self.assertEqual(fh.read_journal(), [])
+        self.assertEqual(fh.read_history_np()[1].size, 4)
+    def test_history_manager_clear_all_compacts(self):
+        self.HM.write_history()
+        self.add_objs(self.HM, 2)
+        self.HM.write_history()
+        self.HM.clear_all()
+        self.HM.write_history()
+        self.assertEqual(fh.read_journal(), [])
+        history = mvm.HistoryManager()
+        history.read_history()
+        self.assertEqual(history.get_labels(), [])
+    def test_history_manager_read_history_ignores_cut_off_record(self):
+        self.HM.write_history()
+        self.add_objs(self.HM, 2)
+        self.HM.write_history()
+        with open(fh.JOURNAL_FILE, 'rb') as file_:
+            data = file_.read()
+        with open(fh.JOURNAL_FILE, 'wb') as file_:
+            file_.write(data[:-10])
+        history = mvm.HistoryManager()
+        history.read_history()
+        self.assertEqual(history.get_labels(), self.HM.get_labels()[:1])
+    def test_history_manager_read_history_cuts_off_broken_journal_end(self):
+        self.HM.write_history()
+        objs = self.add_objs(self.HM, 2)
+        self.HM.write_history()
+        with open(fh.JOURNAL_FILE, 'ab') as file_:
+            file_.write(b'\xff\x00\x00\x00partial')
+        history = mvm.HistoryManager()
+        self.assertEqual(history.read_history(), 'ok: no history')
+        objs += self.add_objs(history, 2)
+        history.write_history()
+        new_history = mvm.HistoryManager()
+        new_history.read_history()
+        self.assertEqual(new_history.get_labels(), history.get_labels())
+        self.assertEqual(len(new_history.get_labels()), len(objs))
+    def test_history_manager_background_write_history_returns_at_once(self):
+        history = mvm.HistoryManager(write_delay=60)
+        self.add_objs(history, 2)
+        history.write_history()
+        self.assertEqual(history.pending_writes(), 2)
+        self.assertEqual(fh.read_journal(), [])
+    def test_history_manager_flush_writes_pending(self):
+        self.HM.write_history()
+        history = mvm.HistoryManager(write_delay=60)
+        history.read_history()
+        self.add_objs(history, 2)
+        history.write_history()
+        history.flush()
+        self.assertEqual(history.pending_writes(), 0)
+        self.assertEqual(len(fh.read_journal()), 2)
+        new_history = mvm.HistoryManager()
+        new_history.read_history()
+        self.assertEqual(new_history.get_labels(), history.get_labels())
+    def test_history_manager_background_writer_coalesces_writes(self):
+        self.HM.write_history()
+        history = mvm.HistoryManager(write_delay=0.05)
+        history.read_history()
+        for _ in range(3):
+            self.add_objs(history, 1)
+            history.write_history()
+        for _ in range(100):
+            if not history.pending_writes() and fh.read_journal():
+                break
+            time.sleep(0.02)
+        self.assertEqual(history.pending_writes(), 0)
+        self.assertEqual(len(fh.read_journal()), 3)
+    def test_history_manager_background_writer_survives_failed_write(self):
+        self.HM.write_history()
+        history = mvm.HistoryManager(write_delay=0.01)
+        history.read_history()
+        def fail(records):
+            raise ValueError('cannot write')
+        append_journal = fh.append_journal
+        fh.append_journal = fail
+        try:
+            objs = self.add_objs(history, 2)
+            history.write_history()
+            for _ in range(100):
+                if history.write_error() is not None:
+                    break
+                time.sleep(0.02)
+        finally:
+            fh.append_journal = append_journal
+        self.assertIsInstance(history.write_error(), ValueError)
+        self.assertEqual(history.pending_writes(), 2)
+        self.assertEqual(fh.read_history_np()[1].size, 0)
+        history.write_history()
+        for _ in range(100):
+            if not history.pending_writes():
+                break
+            time.sleep(0.02)
+        self.assertEqual(history.pending_writes(), 0)
+        self.assertIsNone(history.write_error())
+        self.assertEqual([obj['text'] for obj in fh.read_history_np()[1]],
+                         [obj['text'] for obj in objs])
+    def test_history_manager_failed_flush_raises_and_keeps_pending(self):
+        self.HM.write_history()
+        history = mvm.HistoryManager(write_delay=60)
+        history.read_history()
+        def fail(history, compress=None):
+            raise IOError('disk full')
+        write_history_np = fh.write_history_np
+        fh.write_history_np = fail
+        try:
+            self.add_objs(history, 2)
+            history.clear_all()
+            self.add_objs(history, 1)
+            self.assertRaises(IOError, history.flush)
+        finally:
+            fh.write_history_np = write_history_np
+        self.assertEqual(history.pending_writes(), 2)
+        self.assertIsInstance(history.write_error(), IOError)
+        history.flush()
+        self.assertEqual(history.pending_writes(), 0)
+        new_history = mvm.HistoryManager()
+        new_history.read_history()
+        self.assertEqual(new_history.get_labels(), history.get_labels())
+    def test_history_manager_read_history_loads_entries_when_used(self):
+        objs = self.add_objs(self.HM, 2)
+        self.HM.compact_history()
+        history = mvm.HistoryManager()
+        self.assertEqual(history.read_history(), 'ok')
+        self.assertEqual(history.get_labels(), self.HM.get_labels())
+        self.assertPlainEqual(
+            history.get_obj(objs[1]['text'], objs[1]['tuple_list']), objs[1])
+        self.assertPlainEqual(history.get_graphs(), self.HM.get_graphs())
+    def test_history_manager_drops_entry_that_fails_to_load(self):
+        objs = self.add_objs(self.HM, 2)
+        self.HM.compact_history()
+        with open(fh.HISTORY_FILE, 'rb') as file_:
+            data = file_.read()
+        with open(fh.HISTORY_FILE, 'wb') as file_:
+            file_.write(data.replace(b'[(Die(3), 2)]', b'[(Dxx(3), 2)]'))
+        history = mvm.HistoryManager()
+        self.assertEqual(history.read_history(), 'ok')
+        self.assertEqual(len(history.get_labels()), 2)
+        self.assertEqual(
+            history.get_obj(objs[1]['text'], objs[1]['tuple_list']), {})
+        self.assertEqual(history.get_labels(), self.HM.get_labels()[:1])
+        history.write_history()
+        self.assertEqual(fh.read_history_np()[1].size, 1)
+    def test_history_manager_keeps_no_pts_and_makes_them_again(self):
+        mvm.PTS_CACHE.clear()
+        self.TM.request_add(5, dt.Die(6))
+        self.TM.request_add(200, dt.StrongDie(dt.Die(4), 2))
+        obj = self.TM.request_plot_obj(False)
+        self.HM.add_plot_obj(obj)
+        self.assertNotIn('pts', list(self.HM._history.values())[0])
+        self.assertPlainEqual(self.HM.get_obj(obj['text'], obj['tuple_list']),
+                              obj)
+        self.assertPlainEqual(self.HM.get_graphs()[2],
+                              [(obj['text'], obj['pts'])])
+        self.assertEqual(mvm.PTS_CACHE.info()['entries'], 1)
+    def test_history_manager_pts_cache_is_bounded(self):
+        mvm.PTS_CACHE.set_max_bytes(500)
+        try:
+            objs = self.add_objs(self.HM, 30)
+            self.HM.get_graphs()
+            self.assertLessEqual(mvm.PTS_CACHE.info()['bytes'], 500)
+            self.assertPlainEqual(self.HM.get_obj(objs[0]['text'],
+                                                  objs[0]['tuple_list']),
+                                  objs[0])
+        finally:
+            mvm.PTS_CACHE.set_max_bytes(8 * 2**20)
     def test_history_manager_get_graphs_on_empty_history(self):
         self.assertEqual(
             self.HM.get_graphs(),
@@ -292,13 +864,16 @@ class TestMVM(unittest.TestCase):
     def test_graph_box_graph_it_writes_new_to_file(self):
         #resetting file to empty array
         self.HM.write_history()
-        history = np.load('numpy_history.npy')
+        history = fh.read_history_np()[1]
         self.assertEqual(history.size, 0)
         self.TM.request_add(1, dt.Die(1))
         self.GB.graph_it([('anything', [(1, 100)])])
-        history = np.load('numpy_history.npy')
-        self.assertEqual(history.size, 1)
-        self.assertEqual(history[0], self.TM.request_plot_obj(True))
+        #the new graph is in the journal, not the .npy file
+        history = mvm.HistoryManager()
+        history.read_history()
+        self.assertEqual(len(history._history), 1)
+        self.assertEqual(list(history._history.values())[0],
+                         fh.without_pts(self.TM.request_plot_obj(True)))
     def test_graph_box_graph_it_not_add_to_HM_if_thinks_already_there(self):
         self.TM.request_add(1, dt.Die(1))
         obj = self.TM.request_plot_obj(False)
@@ -307,7 +882,8 @@ class TestMVM(unittest.TestCase):
         self.HM.add_plot_obj(not_obj)
         self.GB.graph_it([(obj['text'], obj['tuple_list'])])
         self.assertEqual(len(self.HM.get_labels()), 1)
-        self.assertEqual(self.HM._history[0], not_obj)
+        self.assertEqual(list(self.HM._history.values())[0],
+                         fh.without_pts(not_obj))
     def test_graph_box_graph_it_retrieves_from_HM_not_TM(self):
         self.TM.request_add(1, dt.Die(2))
         obj_1 = self.TM.request_plot_obj(True)
@@ -317,7 +893,7 @@ class TestMVM(unittest.TestCase):
         self.HM.add_plot_obj(self.TM.request_plot_obj(True))
         self.TM.request_add(1, dt.Die(5))
         text_pts = self.GB.graph_it([('1D2', [(1, 1), (2, 1)])])[2]
-        self.assertEqual(text_pts, [('1D2', [(1, 2), (50.0, 50.0)])])
+        self.assertPlainEqual(text_pts, [('1D2', [(1, 2), (50.0, 50.0)])])
     def test_graph_box_graph_it_retrieves_according_to_use_axes(self):
         self.TM.request_add(1, dt.Die(1))
         axes_obj = self.TM.request_plot_obj(True)
@@ -325,15 +901,57 @@ class TestMVM(unittest.TestCase):
         pts_obj = self.TM.request_plot_obj(False)
         pts_data = (pts_obj['text'], pts_obj['pts'])
         pts_GB = mvm.GraphBox(self.TM, mvm.HistoryManager(), False)
-        self.assertNotEqual(axes_obj, pts_obj)
-        self.assertEqual(
+        self.assertNotEqual(plain(axes_obj), plain(pts_obj))
+        self.assertPlainEqual(
             pts_GB.graph_it([('1D1', [(1, 1)])]),
             ((1, 1), (100.0, 100.0), [pts_data])
         )
-        self.assertEqual(
+        self.assertPlainEqual(
             self.GB.graph_it([('1D1', [(1, 1)])]),
             ((1, 1), (100.0, 100.0), [axes_data])
         )
+    def test_graph_box_graph_it_downsamples_to_max_points(self):
+        self.TM.request_add(200, dt.Die(6))
+        full = self.TM.request_plot_obj(True)
+        self.GB.max_points = 100
+        x_range, y_range, text_pts = self.GB.graph_it([('a', [(1, 1)])])
+        pts = text_pts[0][1]
+        self.assertLessEqual(len(pts[0]), 100)
+        self.assertEqual((pts[0][0], pts[0][-1]), x_range)
+        self.assertEqual(max(pts[1]), y_range[1])
+        self.assertEqual(max(pts[1]), max(full['pts'][1]))
+        self.GB.max_points = None
+        self.assertPlainEqual(self.GB.graph_it([('a', [(1, 1)])])[2],
+                              [(full['text'], full['pts'])])
+    def test_graph_box_graph_pyramids_has_every_point_and_is_cached(self):
+        self.TM.request_add(200, dt.Die(6))
+        full = self.TM.request_plot_obj(True)
+        x_range, y_range, text_pyramid = self.GB.graph_pyramids(
+            [('a', [(1, 1)])])
+        self.assertEqual((x_range, y_range), (full['x_range'],
+                                              full['y_range']))
+        text, pyramid = text_pyramid[0]
+        self.assertEqual(text, full['text'])
+        self.assertPlainEqual(list(pyramid.levels[0]), full['pts'])
+        self.assertEqual(mvm.PYRAMID_CACHE.info()['entries'], 1)
+        again = self.GB.graph_pyramids([(full['text'],
+                                         full['tuple_list'])])[2][0][1]
+        self.assertIs(again, pyramid)
+    def test_graph_box_graph_pyramids_ranges_cover_every_graph(self):
+        self.assertEqual(self.GB.graph_pyramids([]),
+                         ((float('inf'), float('-inf')),
+                          (float('inf'), float('-inf')), []))
+        self.TM.request_add(1, dt.Die(2))
+        objs = [self.TM.request_plot_obj(True)]
+        self.TM.request_add(3, dt.Die(6))
+        objs.append(self.TM.request_plot_obj(True))
+        for obj in objs:
+            self.HM.add_plot_obj(obj)
+        x_range, y_range, _ = self.GB.graph_pyramids(
+            [(obj['text'], obj['tuple_list']) for obj in objs])
+        self.assertEqual(x_range, (1, 20))
+        self.assertEqual(y_range, (min(objs[1]['y_range']),
+                                   max(objs[0]['y_range'])))
     def test_graph_box_clear_selected_does_nothing_with_empty_list(self):
         self.TM.request_add(1, dt.Die(1))
         self.HM.add_plot_obj(self.TM.request_plot_obj(True))
@@ -354,6 +972,19 @@ class TestMVM(unittest.TestCase):
         self.GB.clear_selected([('2D1', [(2, 1)]),
                                 ('2D1 \\ 1D2', [(3, 1), (4, 1)])])
         self.assertEqual(self.HM.get_labels(), [('1D1', [(1, 1)])])
+    def test_graph_box_clear_selected_doesnt_load_entries(self):
+        objs = self.add_objs(self.HM, 2)
+        self.HM.compact_history()
+        history = mvm.HistoryManager()
+        history.read_history()
+        def load():
+            raise AssertionError('entry was loaded')
+        for key in history._loaders:
+            history._loaders[key] = load
+        graph_box = mvm.GraphBox(self.TM, history, True)
+        graph_box.clear_selected([(objs[0]['text'], objs[0]['tuple_list'])])
+        self.assertEqual(history.get_labels(),
+                         [(objs[1]['text'], objs[1]['tuple_list'])])
     def test_graph_box_clear_selected_writes_history(self):
         self.TM.request_add(1, dt.Die(1))
         expected_for_hist = self.TM.request_plot_obj(True)
@@ -364,9 +995,9 @@ class TestMVM(unittest.TestCase):
         self.HM.add_plot_obj(self.TM.request_plot_obj(True))
         self.GB.clear_selected([('2D1', [(2, 1)]),
                                 ('2D1 \\ 1D2', [(3, 1), (4, 1)])])
-        history = np.load('numpy_history.npy')
+        history = fh.read_history_np()[1]
         self.assertEqual(history.size, 1)
-        self.assertEqual(history[0], expected_for_hist)
+        self.assertEqual(history[0], fh.without_pts(expected_for_hist))
     def test_graph_box_clear_all_works_and_writes_empty_history(self):
         self.TM.request_add(1, dt.Die(1))
         self.HM.add_plot_obj(self.TM.request_plot_obj(True))
@@ -376,7 +1007,7 @@ class TestMVM(unittest.TestCase):
         self.HM.add_plot_obj(self.TM.request_plot_obj(True))
         self.GB.clear_all()
         self.assertEqual(self.HM.get_labels(), [])
-        self.assertEqual(np.load('numpy_history.npy').size, 0)
+        self.assertEqual(fh.read_history_np()[1].size, 0)
     def test_graph_box_display_returns_empty(self):
         self.assertEqual(self.GB.display(), (('', [(0, 1)]), []))
     def test_graph_box_display_returns_as_expected(self):
@@ -394,7 +1025,7 @@ class TestMVM(unittest.TestCase):
         self.TM.request_add(1, dt.Die(1))
         current_state = self.TM.request_plot_obj(False)
         self.GB.reload('abc', [(1, 2)])
-        self.assertEqual(self.TM.request_plot_obj(False), current_state)
+        self.assertPlainEqual(self.TM.request_plot_obj(False), current_state)
     def test_graph_box_reload_works_as_expected(self):
         self.TM.request_add(1, dt.Die(1))
         obj = self.TM.request_plot_obj(True)
@@ -402,7 +1033,17 @@ class TestMVM(unittest.TestCase):
         self.TM.request_add(1, dt.Die(2))
 
         self.GB.reload('1D1', [(1, 1)])
-        self.assertEqual(self.TM.request_plot_obj(True), obj)
+        self.assertPlainEqual(self.TM.request_plot_obj(True), obj)
+    def test_graph_box_reload_does_nothing_if_obj_is_inconsistent(self):
+        self.TM.request_add(1, dt.Die(2))
+        obj = self.TM.request_plot_obj(True)
+        obj['tuple_list'] = [(1, 1), (2, 5)]
+        self.HM.add_plot_obj(obj)
+        self.TM.request_add(1, dt.Die(2))
+        mvm.TABLE_CACHE.clear()
+        current_state = self.TM.request_plot_obj(False)
+        self.GB.reload('1D2', [(1, 1), (2, 5)])
+        self.assertPlainEqual(self.TM.request_plot_obj(False), current_state)
 
     def test_get_add_rm_box_display_lt_size6(self):
         self.assertEqual(
@@ -549,6 +1190,16 @@ class TestMVM(unittest.TestCase):
                      '    that\'s a one in 4.000 chance\n'+
                      '    or 25.00 percent')
         self.assertEqual(self.SB.display_stats(4, 4), [stat_text, (4, 4)])
+    def test_stat_box_display_percentiles(self):
+        self.TM.request_add(2, dt.Die(2))
+        stat_text = ('\n' +
+                     '    5% or more of rolls are 2 or less\n' +
+                     '    50% or more of rolls are 3 or less\n' +
+                     '    95% or more of rolls are 4 or less\n' +
+                     '\n    2 or less: 25.00 percent\n' +
+                     '    4 or more: 25.00 percent')
+        self.assertEqual(self.SB.display_percentiles(8, -2, (5, 50, 95)),
+                         [stat_text, (4, 2)])
     def test_stat_box_display(self):
         self.TM.request_add(2, dt.Die(2))
         stat_text = ('\n    2-4 occurred 4 times\n'+
@@ -1,12 +1,14 @@
 # pylint: disable=missing-docstring, invalid-name, too-many-public-methods
 '''tests for the longintmath.py module'''
 from __future__ import absolute_import
+import mmap
 import os
 import unittest
 import dicetables as dt
 import numpy as np
 
 import file_handler as fh
+import freq_math as fm
 
 def create_plot_object(table):
     '''converts the table into a PlotObject'''
@@ -21,6 +23,9 @@ def create_plot_object(table):
     new_object['dice'] = table.get_list()
     return new_object
 
+def without_pts(history):
+    '''the history as it is read back'''
+    return np.array([fh.without_pts(plot_obj) for plot_obj in history])
 
 class Testfh(unittest.TestCase):
     def assertArrayEqual(self, nparray_1, nparray_2):
@@ -63,6 +68,25 @@ class Testfh(unittest.TestCase):
         obj = create_plot_object(dt.DiceTable())
         obj['tuple_list'] = [(10*1000, 2)]
         self.assertEqual(fh.check_data(obj), 'ok')
+    def test_check_data_frequencies_in_tuple_list_ok(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        obj = create_plot_object(table)
+        obj['tuple_list'] = fm.Frequencies.from_tuple_list(obj['tuple_list'])
+        self.assertEqual(fh.check_data(obj), 'ok')
+    def test_check_data_big_frequencies_in_tuple_list_ok(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        obj = create_plot_object(table)
+        obj['tuple_list'] = fm.Frequencies(1, np.array([10**100, 1],
+                                                       dtype=object))
+        self.assertEqual(fh.check_data(obj), 'ok')
+    def test_check_data_corrupted_frequencies_in_tuple_list(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        obj = create_plot_object(table)
+        obj['tuple_list'] = fm.Frequencies(1, np.array([1.5, 2.0]))
+        self.assertEqual(fh.check_data(obj), 'error: corrupted "tuple_list"')
     def test_check_data_incorrect_val_in_tuple_list(self):
         obj = create_plot_object(dt.DiceTable())
         obj['tuple_list'] = [(10*1000, 2.0)]
@@ -75,13 +99,25 @@ class Testfh(unittest.TestCase):
         obj = create_plot_object(dt.DiceTable())
         obj['dice'] = [('a', 2.)]
         self.assertEqual(fh.check_data(obj), 'error: dicelist at (\'a\', 2.0)')
-    def test_check_data_reports_multiple_errors(self):
+    def test_check_data_stops_at_first_error(self):
         obj = create_plot_object(dt.DiceTable())
         obj['tuple_list'] = [(10*1000, 2.0)]
         obj['dice'] = [('a', 2.)]
-        self.assertEqual(
-            fh.check_data(obj),
-            'error: corrupted "tuple_list" dicelist at (\'a\', 2.0)')
+        self.assertEqual(fh.check_data(obj), 'error: corrupted "tuple_list"')
+    def test_check_data_corrupted_pts(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        obj = create_plot_object(table)
+        obj['pts'][3] = (6, 'a')
+        self.assertEqual(fh.check_data(obj), 'error: corrupted "pts"')
+        obj['pts'][3] = (6,)
+        self.assertEqual(fh.check_data(obj), 'error: corrupted "pts"')
+    def test_check_data_big_ints_in_tuple_list_ok(self):
+        obj = create_plot_object(dt.DiceTable())
+        obj['tuple_list'] = [(1, 10**100), (2, 1)]
+        self.assertEqual(fh.check_data(obj), 'ok')
+        obj['tuple_list'] = [(1, 10**100), (2, 1.0)]
+        self.assertEqual(fh.check_data(obj), 'error: corrupted "tuple_list"')
     def test_check_data_all_die_types_pass(self):
         table = dt.DiceTable()
         table.add_die(1, dt.Die(4))
@@ -92,6 +128,30 @@ class Testfh(unittest.TestCase):
         obj = create_plot_object(table)
         self.assertEqual(fh.check_data(obj), 'ok')
 
+    def test_check_data_without_pts(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        obj = fh.without_pts(create_plot_object(table))
+        self.assertEqual(obj['axes'], False)
+        self.assertNotIn('pts', obj)
+        self.assertEqual(fh.check_data(obj), 'ok')
+        obj['axes'] = 1
+        self.assertIn(fh.check_data(obj), ("error: axes not <type 'bool'>",
+                                           "error: axes not <class 'bool'>"))
+    def test_without_pts_axes(self):
+        table = dt.DiceTable()
+        table.add_die(1, dt.Die(2))
+        obj = create_plot_object(table)
+        obj['pts'] = dt.graph_pts(table, axes=True)
+        self.assertEqual(fh.without_pts(obj)['axes'], True)
+        obj['pts'] = dt.graph_pts(table, axes=False)
+        self.assertEqual(fh.without_pts(obj)['axes'], False)
+        rows = np.array([[1., 50.], [2., 50.]])
+        obj['pts'] = [rows[:, 0], rows[:, 1]]
+        self.assertEqual(fh.without_pts(obj)['axes'], True)
+        obj['pts'] = rows
+        self.assertEqual(fh.without_pts(obj)['axes'], False)
+
     def test_check_history_breaks_at_first_error(self):
         obj1 = create_plot_object(dt.DiceTable())
         obj2 = create_plot_object(dt.DiceTable())
@@ -116,14 +176,14 @@ class Testfh(unittest.TestCase):
         fh.write_history_np(hist)
         msg, new_hist = fh.read_history_np()
         self.assertEqual(msg, 'ok')
-        self.assertArrayEqual(hist, new_hist)
+        self.assertArrayEqual(without_pts(hist), new_hist)
     def test_read_np_returns_error_and_empty_if_check_hist_has_error(self):
-        fh.write_history_np(np.array([1, 2, 3]))
+        np.save(fh.HISTORY_FILE, np.array([1, 2, 3]))
         msg, hist = fh.read_history_np()
         self.assertEqual(msg, 'error: not a dict')
         self.assertArrayEqual(hist, np.array([], dtype=object))
     def test_read_np_returns_error_and_empty_if_hist_empty_and_wrong_type(self):
-        fh.write_history_np(np.array([]))
+        np.save(fh.HISTORY_FILE, np.array([]))
         msg, hist = fh.read_history_np()
         self.assertEqual(msg, 'error: wrong array type')
         self.assertArrayEqual(hist, np.array([], dtype=object))
@@ -157,6 +217,232 @@ class Testfh(unittest.TestCase):
         msg, hist = fh.read_history_np()
         self.assertEqual(msg, 'error: file corrupted')
         self.assertArrayEqual(hist, np.array([], dtype=object))
+    def test_write_history_np_raises_error_if_check_hist_has_error(self):
+        self.assertRaises(ValueError, fh.write_history_np, np.array([1, 2, 3]))
+    def test_write_history_np_is_columnar_not_pickled(self):
+        fh.write_history_np(np.array([create_plot_object(dt.DiceTable())]))
+        with open(fh.HISTORY_FILE, 'rb') as file_:
+            self.assertEqual(file_.read(6), fh.HISTORY_MAGIC)
+    def test_read_np_reads_legacy_pickled_file(self):
+        table = dt.DiceTable()
+        table.add_die(2, dt.Die(4))
+        hist = np.array([create_plot_object(table)])
+        np.save(fh.HISTORY_FILE, hist)
+        msg, new_hist = fh.read_history_np()
+        self.assertEqual(msg, 'ok')
+        self.assertArrayEqual(without_pts(hist), new_hist)
+    def test_read_write_hist_np_all_dice_and_big_frequencies(self):
+        table = dt.DiceTable()
+        table.add_die(2, dt.StrongDie(dt.ModWeightedDie({1: 2, 3: 1}, -2), 3))
+        table.add_die(1, dt.WeightedDie({1: 1, 2: 0, 3: 4}))
+        table.add_die(300, dt.ModDie(6, 1))
+        obj = create_plot_object(table)
+        obj['pts'] = dt.graph_pts(table, axes=True)
+        fh.write_history_np(np.array([obj, create_plot_object(dt.DiceTable())]))
+        msg, new_hist = fh.read_history_np()
+        self.assertEqual(msg, 'ok')
+        self.assertEqual(new_hist[0], fh.without_pts(obj))
+        self.assertTrue(new_hist[0]['axes'])
+        self.assertEqual(new_hist[0]['tuple_list'].array.dtype, np.dtype('O'))
+    def test_read_np_frequencies_are_memory_mapped(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        fh.write_history_np(np.array([create_plot_object(table)]))
+        array = fh.read_history_np()[1][0]['tuple_list'].array
+        while isinstance(array, np.ndarray):
+            array = array.base
+        self.assertIsInstance(array, mmap.mmap)
+    def test_read_np_returns_error_for_newer_version(self):
+        fh.write_history_np(np.array([create_plot_object(dt.DiceTable())]))
+        with open(fh.HISTORY_FILE, 'r+b') as file_:
+            file_.seek(6)
+            file_.write(b'\xff\x00')
+        msg, hist = fh.read_history_np()
+        self.assertEqual(msg, 'error: file corrupted')
+        self.assertArrayEqual(hist, np.array([], dtype=object))
+    def test_read_history_index_loads_entries_on_demand(self):
+        table = dt.DiceTable()
+        table.add_die(2, dt.Die(3))
+        obj = create_plot_object(table)
+        fh.write_history_np(np.array([obj]))
+        msg, entries = fh.read_history_index()
+        self.assertEqual(msg, 'ok')
+        text, frequencies, load = entries[0]
+        self.assertEqual(text, obj['text'])
+        self.assertEqual(frequencies.digest(),
+                         fm.Frequencies.from_tuple_list(obj['tuple_list']).digest())
+        self.assertEqual(load(), fh.without_pts(obj))
+    def test_read_history_index_corrupted_entry_raises_on_load(self):
+        table = dt.DiceTable()
+        table.add_die(2, dt.Die(3))
+        fh.write_history_np(np.array([create_plot_object(table)]))
+        with open(fh.HISTORY_FILE, 'rb') as file_:
+            data = file_.read()
+        with open(fh.HISTORY_FILE, 'wb') as file_:
+            file_.write(data.replace(b'Die(3)', b'Dxx(3)'))
+        msg, entries = fh.read_history_index()
+        self.assertEqual(msg, 'ok')
+        self.assertRaises(ValueError, entries[0][2])
+    def test_read_history_index_no_history_and_no_file(self):
+        fh.write_history_np(np.array([], dtype=object))
+        self.assertEqual(fh.read_history_index(), ('ok: no history', []))
+        os.remove(fh.HISTORY_FILE)
+        self.assertEqual(fh.read_history_index(), ('error: no file', []))
+    def test_read_np_checksum_matches_until_entry_changes(self):
+        table = dt.DiceTable()
+        table.add_die(2, dt.Die(3))
+        obj = create_plot_object(table)
+        fh.write_history_np(np.array([obj]))
+        source = fh._ColumnHistory(*fh._read_columns(fh.HISTORY_FILE))
+        self.assertTrue(source.checksum_matches(0))
+        with open(fh.HISTORY_FILE, 'rb') as file_:
+            data = file_.read()
+        with open(fh.HISTORY_FILE, 'wb') as file_:
+            file_.write(data.replace(np.array([obj['y_range'][1]]).tobytes(),
+                                     np.array([5.0]).tobytes()))
+        source = fh._ColumnHistory(*fh._read_columns(fh.HISTORY_FILE))
+        self.assertFalse(source.checksum_matches(0))
+        msg, hist = fh.read_history_np()
+        self.assertEqual(msg, 'ok')
+        self.assertEqual(hist[0]['y_range'][1], 5.0)
+    def test_varint_encode_and_decode(self):
+        values = np.array([0, 1, 127, 128, 2**35, 2**63, 2**64 - 1],
+                          dtype=np.uint64)
+        data = fh._varint_encode(values)
+        self.assertEqual(data[:4].tolist(), [0, 1, 127, 128])
+        self.assertEqual(fh._varint_decode(data).tolist(), values.tolist())
+    def test_delta_encode_and_decode(self):
+        column = np.array([5, 1, 2**61, -3, 0, 2**61 - 1], dtype=np.int64)
+        self.assertEqual(fh._delta_decode(fh._delta_encode(column)).tolist(),
+                         column.tolist())
+    def test_read_write_hist_np_compressed(self):
+        hist = []
+        table = dt.DiceTable()
+        for _ in range(10):
+            table.add_die(5, dt.Die(6))
+            hist.append(create_plot_object(table))
+        hist = np.array(hist)
+        fh.write_history_np(hist)
+        raw_size = os.path.getsize(fh.HISTORY_FILE)
+        for compress in ('zlib', 'lzma'):
+            if compress not in fh._COMPRESSORS:
+                continue
+            fh.write_history_np(hist, compress)
+            self.assertLess(os.path.getsize(fh.HISTORY_FILE), raw_size / 2)
+            msg, new_hist = fh.read_history_np()
+            self.assertEqual(msg, 'ok')
+            self.assertArrayEqual(without_pts(hist), new_hist)
+            msg, entries = fh.read_history_index()
+            self.assertEqual(entries[3][2](), fh.without_pts(hist[3]))
+    def test_write_history_np_unknown_compression(self):
+        self.assertRaises(ValueError, fh.write_history_np,
+                          np.array([], dtype=object), 'rar')
+    def test_read_np_corrupted_compressed_column(self):
+        table = dt.DiceTable()
+        table.add_die(5, dt.Die(6))
+        fh.write_history_np(np.array([create_plot_object(table)]), 'zlib')
+        with open(fh.HISTORY_FILE, 'rb') as file_:
+            data = file_.read()
+        #b'\x78\x9c' starts each column that zlib compressed
+        start = data.index(b'\x78\x9c') + 2
+        with open(fh.HISTORY_FILE, 'wb') as file_:
+            file_.write(data[:start] + b'garbage' + data[start + 7:])
+        msg, hist = fh.read_history_np()
+        self.assertEqual(msg, 'error: file corrupted')
+    def test_write_history_np_leaves_no_temp_file(self):
+        fh.write_history_np(np.array([], dtype=object))
+        self.assertFalse(os.path.exists('numpy_history.npy.tmp'))
+    def test_write_history_np_clears_journal(self):
+        fh.append_journal([('clear', None)])
+        fh.write_history_np(np.array([], dtype=object))
+        self.assertFalse(os.path.exists(fh.JOURNAL_FILE))
+    def migrate(self, compress=None):
+        msg, errors = fh.migrate_history(compress=compress)
+        if os.path.exists(fh.HISTORY_FILE + '.legacy'):
+            os.remove(fh.HISTORY_FILE + '.legacy')
+        return msg, errors
+    def test_migrate_history_legacy_file_keeps_good_entries(self):
+        table = dt.DiceTable()
+        hist = []
+        for _ in range(3):
+            table.add_die(2, dt.Die(6))
+            hist.append(create_plot_object(table))
+        hist[1]['x_range'] = (1.0, 2)
+        np.save(fh.HISTORY_FILE, np.array(hist))
+        msg, errors = fh.migrate_history()
+        self.assertEqual(msg, 'ok: migrated, 1 entries left out')
+        self.assertEqual(errors, [(1, 'error: incorrect x_range')])
+        with open(fh.HISTORY_FILE + '.legacy', 'rb') as file_:
+            self.assertEqual(file_.read(6), b'\x93NUMPY')
+        os.remove(fh.HISTORY_FILE + '.legacy')
+        msg, new_hist = fh.read_history_np()
+        self.assertEqual(msg, 'ok')
+        self.assertArrayEqual(without_pts([hist[0], hist[2]]), new_hist)
+    def test_migrate_history_is_idempotent(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        np.save(fh.HISTORY_FILE, np.array([create_plot_object(table)]))
+        self.assertEqual(self.migrate(), ('ok: migrated', []))
+        with open(fh.HISTORY_FILE, 'rb') as file_:
+            data = file_.read()
+        self.assertEqual(self.migrate(), ('ok: up to date', []))
+        with open(fh.HISTORY_FILE, 'rb') as file_:
+            self.assertEqual(file_.read(), data)
+    def test_migrate_history_older_columnar_file_and_compression(self):
+        table = dt.DiceTable()
+        table.add_die(3, dt.Die(6))
+        hist = np.array([create_plot_object(table)])
+        fh.write_history_np(hist)
+        with open(fh.HISTORY_FILE, 'r+b') as file_:
+            file_.seek(6)
+            file_.write(b'\x04\x00')
+        self.assertEqual(self.migrate(), ('ok: migrated', []))
+        self.assertEqual(self.migrate('zlib'), ('ok: migrated', []))
+        self.assertEqual(self.migrate('zlib'), ('ok: up to date', []))
+        msg, new_hist = fh.read_history_np()
+        self.assertArrayEqual(without_pts(hist), new_hist)
+    def test_migrate_history_errors(self):
+        np.save(fh.HISTORY_FILE, np.array([1, 2, 3]))
+        self.assertEqual(self.migrate(), ('error: wrong array type', []))
+        with open(fh.HISTORY_FILE, 'wb') as file_:
+            file_.write(b'DTHIST garbage')
+        self.assertEqual(self.migrate(), ('error: file corrupted', []))
+        os.remove(fh.HISTORY_FILE)
+        self.assertEqual(self.migrate(), ('error: no file', []))
+        self.assertRaises(ValueError, fh.migrate_history, None, 'rar')
+    def test_append_and_read_journal(self):
+        obj = create_plot_object(dt.DiceTable())
+        fh.clear_journal()
+        fh.append_journal([('add', obj), ('remove', ('a', 'b'))])
+        fh.append_journal([('clear', None)])
+        self.assertEqual(fh.read_journal(),
+                         [('add', obj), ('remove', ('a', 'b')), ('clear', None)])
+        fh.clear_journal()
+    def test_read_journal_no_file(self):
+        fh.clear_journal()
+        self.assertEqual(fh.read_journal(), [])
+    def test_read_journal_stops_at_corrupted_record(self):
+        fh.clear_journal()
+        fh.append_journal([('clear', None)])
+        with open(fh.JOURNAL_FILE, 'ab') as file_:
+            file_.write(b'\x05\x00\x00\x00abcde')
+        fh.append_journal([('clear', None)])
+        self.assertEqual(fh.read_journal(), [('clear', None)])
+        fh.clear_journal()
+    def test_read_journal_repair_cuts_off_broken_end(self):
+        fh.clear_journal()
+        fh.append_journal([('clear', None)])
+        with open(fh.JOURNAL_FILE, 'rb') as file_:
+            whole = file_.read()
+        with open(fh.JOURNAL_FILE, 'ab') as file_:
+            file_.write(b'\xff\x00\x00\x00partial')
+        self.assertEqual(fh.read_journal(repair=True), [('clear', None)])
+        with open(fh.JOURNAL_FILE, 'rb') as file_:
+            self.assertEqual(file_.read(), whole)
+        fh.append_journal([('remove', ('a', 'b'))])
+        self.assertEqual(fh.read_journal(),
+                         [('clear', None), ('remove', ('a', 'b'))])
+        fh.clear_journal()
 
 if __name__ == '__main__':
     unittest.main()
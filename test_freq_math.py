@@ -0,0 +1,343 @@
+# pylint: disable=missing-docstring, invalid-name, too-many-public-methods
+'''tests for the freq_math.py module'''
+from __future__ import absolute_import
+
+import pickle
+import unittest
+
+import numpy as np
+import dicetables as dt
+import freq_math as fm
+
+def naive_convolve(first, second):
+    answer = [0] * (len(first) + len(second) - 1)
+    for index_1, val_1 in enumerate(first):
+        for index_2, val_2 in enumerate(second):
+            answer[index_1 + index_2] += int(val_1) * int(val_2)
+    return answer
+
+def table_tuple_list(*dice_numbers):
+    table = dt.DiceTable()
+    for die, number in dice_numbers:
+        table.add_die(number, die)
+    return table.frequency_all()
+
+
+class TestFreqMath(unittest.TestCase):
+    def test_percents(self):
+        self.assertEqual(fm.percents(np.array([1, 2, 1])).tolist(),
+                         [25.0, 50.0, 25.0])
+    def test_percents_are_graph_pts_to_float_precision(self):
+        table = dt.DiceTable()
+        table.add_die(2, dt.ModWeightedDie({1: 10**20, 2: 1}, -3))
+        table.add_die(40, dt.Die(100))
+        array = fm.from_tuple_list(table.frequency_all())[1]
+        self.assertEqual(array.dtype, np.dtype('O'))
+        y_vals = dt.graph_pts(table, axes=True, exact=False)[1]
+        #graph_pts floors to 50 decimal places first
+        for answer, expected in zip(fm.percents(array).tolist(), y_vals):
+            self.assertAlmostEqual(answer, expected,
+                                   delta=max(expected * 1e-8, 1e-48))
+    def test_percents_big_ints_dont_overflow(self):
+        array = np.array([10**400, 3 * 10**400, 1], dtype=object)
+        answer = fm.percents(array)
+        self.assertEqual(answer.dtype, np.float64)
+        self.assertEqual(answer.tolist(), [25.0, 75.0, 0.0])
+        array = np.array([2**1000 + 1, 2**999], dtype=object)
+        self.assertAlmostEqual(fm.percents(array)[0], 200. / 3)
+    def test_from_tuple_list_fills_in_zeros(self):
+        offset, array = fm.from_tuple_list([(-2, 1), (1, 3)])
+        self.assertEqual(offset, -2)
+        self.assertEqual(array.tolist(), [1, 0, 0, 3])
+        self.assertEqual(array.dtype, np.int64)
+    def test_from_tuple_list_ignores_zero_frequencies(self):
+        offset, array = fm.from_tuple_list([(0, 0), (2, 1), (3, 0)])
+        self.assertEqual(offset, 2)
+        self.assertEqual(array.tolist(), [1])
+    def test_from_tuple_list_big_numbers_are_object_array(self):
+        offset, array = fm.from_tuple_list([(1, 10**100), (2, 1)])
+        self.assertEqual(offset, 1)
+        self.assertEqual(array.dtype, np.dtype('O'))
+        self.assertEqual(array.tolist(), [10**100, 1])
+    def test_from_tuple_list_empty_raises_error(self):
+        self.assertRaises(ValueError, fm.from_tuple_list, [(1, 0)])
+    def test_to_tuple_list_removes_zeros(self):
+        self.assertEqual(fm.to_tuple_list(-1, np.array([1, 0, 2, 0])),
+                         [(-1, 1), (1, 2)])
+    def test_to_tuple_list_returns_python_ints(self):
+        tuple_list = fm.to_tuple_list(0, np.array([5], dtype=np.int64))
+        self.assertIs(type(tuple_list[0][0]), int)
+        self.assertIs(type(tuple_list[0][1]), int)
+    def test_to_tuple_list_from_tuple_list_round_trip(self):
+        tuple_list = table_tuple_list((dt.Die(6), 30), (dt.ModDie(4, -5), 2))
+        self.assertEqual(fm.to_tuple_list(*fm.from_tuple_list(tuple_list)),
+                         tuple_list)
+    def test_die_frequencies(self):
+        offset, array = fm.die_frequencies(dt.ModWeightedDie({1: 2, 3: 1}, -2))
+        self.assertEqual(offset, -1)
+        self.assertEqual(array.tolist(), [2, 0, 1])
+
+    def test_convolve_small(self):
+        self.assertEqual(
+            fm.convolve(np.array([1, 2]), np.array([3, 0, 1])).tolist(),
+            [3, 6, 1, 2])
+    def test_convolve_uses_fft_sized_arrays_exactly(self):
+        first = np.arange(1, 301, dtype=np.int64)
+        second = np.arange(500, 100, -1, dtype=np.int64)
+        self.assertEqual(fm.convolve(first, second).tolist(),
+                         naive_convolve(first, second))
+    def test_convolve_int64_sized_answer(self):
+        first = np.array([10**8, 1, 10**8] * 30, dtype=np.int64)
+        answer = fm.convolve(first, first)
+        self.assertEqual(answer.tolist(), naive_convolve(first, first))
+        self.assertEqual(answer.dtype, np.int64)
+    def test_convolve_big_numbers(self):
+        first = np.array([10**30, 1, 2**70], dtype=object)
+        second = np.array([3, 10**15], dtype=np.int64)
+        self.assertEqual(fm.convolve(first, second).tolist(),
+                         naive_convolve(first, second))
+
+    def test_convolve_big_numbers_long_arrays(self):
+        first = np.array([3**200 + num for num in range(100)], dtype=object)
+        second = np.array([2**150 * num for num in range(80)], dtype=object)
+        self.assertEqual(fm.convolve(first, second).tolist(),
+                         naive_convolve(first, second))
+
+    def test_primes_are_biggest_primes_below_bits(self):
+        self.assertEqual(fm._primes(4, 10), [13, 11, 7, 5, 3, 2])
+        self.assertEqual(fm._primes(8, 3), [251, 241, 239])
+        self.assertEqual(fm._primes(30, 2), [1073741789, 1073741783])
+    def test_residues_small_and_big_arrays_agree(self):
+        primes = fm._primes(20, 5)
+        small = np.array([5, 10**12, 0], dtype=np.int64)
+        self.assertEqual(fm._residues(small, primes).tolist(),
+                         fm._residues(small.astype(object), primes).tolist())
+    def test_residues_then_chinese_remainder_round_trip(self):
+        primes = fm._primes(30, 7)
+        array = np.array([0, 1, 2**200 - 1, 7**50], dtype=object)
+        self.assertEqual(
+            fm._chinese_remainder(fm._residues(array, primes), primes).tolist(),
+            array.tolist())
+    def test_mod_convolve_matches_naive(self):
+        primes = fm._primes(26, 4)
+        first = np.array([2**40 + num for num in range(200)], dtype=object)
+        second = np.array([3**20 * num for num in range(150)], dtype=object)
+        expected = [num % primes[1] for num in naive_convolve(first, second)]
+        answer = fm._mod_convolve(fm._residues(first, primes),
+                                  fm._residues(second, primes), primes, 13)
+        self.assertEqual(answer[1].tolist(), expected)
+    def test_modulus_plan_product_of_primes_beats_bound(self):
+        primes, piece_bits = fm._modulus_plan(5000, 10**300)
+        product = 1
+        for prime in primes:
+            self.assertLess(prime, 2**(2 * piece_bits))
+            product *= prime
+        self.assertGreater(product, 10**300)
+    def test_modulus_plan_none_if_too_long(self):
+        self.assertIsNone(fm._modulus_plan(2**40, 10**300))
+
+    def test_total(self):
+        self.assertEqual(fm.total(np.array([2**61, 2**61, 2**61])), 3 * 2**61)
+    def test_running_total(self):
+        answer = fm.running_total(np.array([1, 0, 5, 2]))
+        self.assertEqual(answer.tolist(), [0, 1, 1, 6, 8])
+        self.assertEqual(answer.dtype, np.int64)
+    def test_running_total_switches_to_object_before_overflow(self):
+        answer = fm.running_total(np.array([2**61, 2**61, 2**61]))
+        self.assertEqual(answer.tolist(), [0, 2**61, 2**62, 3 * 2**61])
+        self.assertEqual(answer.dtype, np.dtype('O'))
+    def test_product_matches_dicetables(self):
+        offset, array = fm.product([
+            (1, np.array([1] * 6), 100),
+            (-1, np.array([1, 0, 2]), 3),
+            (0, np.array([5]), 0)])
+        self.assertEqual(
+            fm.to_tuple_list(offset, array),
+            table_tuple_list((dt.Die(6), 100),
+                             (dt.ModWeightedDie({1: 1, 3: 2}, -2), 3)))
+    def test_product_of_nothing(self):
+        offset, array = fm.product([])
+        self.assertEqual((offset, array.tolist()), (0, [1]))
+
+    def test_power_zero(self):
+        offset, array = fm.power(3, np.array([1, 1]), 0)
+        self.assertEqual(offset, 0)
+        self.assertEqual(array.tolist(), [1])
+    def test_power_negative_raises_error(self):
+        self.assertRaises(ValueError, fm.power, 1, np.array([1]), -1)
+    def test_power_matches_dicetables(self):
+        for number in (1, 2, 7, 16):
+            offset, array = fm.power(1, np.array([1] * 6), number)
+            self.assertEqual(fm.to_tuple_list(offset, array),
+                             table_tuple_list((dt.Die(6), number)))
+    def test_power_big_numbers_match_dicetables(self):
+        die_offset, die_array = fm.die_frequencies(dt.Die(20))
+        offset, array = fm.power(die_offset, die_array, 40)
+        self.assertEqual(fm.to_tuple_list(offset, array),
+                         table_tuple_list((dt.Die(20), 40)))
+    def test_add_dice(self):
+        start_offset, start = fm.from_tuple_list(
+            table_tuple_list((dt.Die(3), 2)))
+        offset, array = fm.add_dice(start_offset, start,
+                                    dt.StrongDie(dt.Die(3), 2), 3)
+        self.assertEqual(
+            fm.to_tuple_list(offset, array),
+            table_tuple_list((dt.Die(3), 2), (dt.StrongDie(dt.Die(3), 2), 3)))
+
+    def test_divide_small(self):
+        answer = fm.divide(np.array([3, 6, 1, 2]), np.array([3, 0, 1]))
+        self.assertEqual(answer.tolist(), [1, 2])
+        self.assertEqual(answer.dtype, np.int64)
+    def test_divide_big_numbers(self):
+        first = np.array([3**200 + num for num in range(100)], dtype=object)
+        second = np.array([2**150 * num for num in range(1, 80)], dtype=object)
+        dividend = np.array(naive_convolve(first, second), dtype=object)
+        self.assertEqual(fm.divide(dividend, second).tolist(), first.tolist())
+    def test_divide_long_divisor(self):
+        first = np.array([5**30 + num for num in range(600)], dtype=object)
+        second = np.array([7**20 + num for num in range(300)], dtype=object)
+        dividend = fm.convolve(first, second)
+        self.assertEqual(fm.divide(dividend, second).tolist(), first.tolist())
+    def test_divide_by_itself(self):
+        array = np.array([1, 3, 3, 1])
+        self.assertEqual(fm.divide(array, array).tolist(), [1])
+    def test_divide_not_divisible_raises_error(self):
+        self.assertRaises(ValueError, fm.divide,
+                          np.array([1, 2, 3]), np.array([1, 1]))
+        self.assertRaises(ValueError, fm.divide,
+                          np.array([1, 2]), np.array([1, 1, 1]))
+    def test_divide_not_divisible_long_divisor_raises_error(self):
+        divisor = np.array([1] * 300, dtype=np.int64)
+        dividend = fm.convolve(np.array([1] * 400, dtype=np.int64), divisor)
+        dividend[350] += 300
+        dividend[351] -= 300
+        self.assertRaises(ValueError, fm.divide, dividend, divisor)
+    def test_remove_dice_matches_dicetables(self):
+        start_offset, start = fm.from_tuple_list(
+            table_tuple_list((dt.Die(6), 50), (dt.ModDie(4, -2), 3)))
+        offset, array = fm.remove_dice(start_offset, start, dt.Die(6), 20)
+        self.assertEqual(
+            fm.to_tuple_list(offset, array),
+            table_tuple_list((dt.Die(6), 30), (dt.ModDie(4, -2), 3)))
+    def test_remove_dice_not_there_raises_error(self):
+        start_offset, start = fm.from_tuple_list(
+            table_tuple_list((dt.Die(6), 5)))
+        self.assertRaises(ValueError, fm.remove_dice,
+                          start_offset, start, dt.Die(4), 1)
+
+    def test_array_bytes(self):
+        self.assertEqual(fm.array_bytes(np.array([1, 2], dtype=np.int64)), 16)
+        self.assertGreater(fm.array_bytes(np.array([2**100], dtype=object)),
+                           fm.array_bytes(np.array([1], dtype=object)))
+    def test_frequency_cache_get_and_put(self):
+        cache = fm.FrequencyCache(1000)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', 3, np.array([1, 2]))
+        offset, array = cache.get('a')
+        self.assertEqual((offset, array.tolist()), (3, [1, 2]))
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 1, 'entries': 1,
+                                        'bytes': 16, 'max_bytes': 1000})
+    def test_frequency_cache_arrays_are_read_only(self):
+        cache = fm.FrequencyCache(1000)
+        original = np.array([1, 2])
+        cache.put('a', 0, original)
+        array = cache.get('a')[1]
+        self.assertRaises(ValueError, array.__setitem__, 0, 5)
+        original[0] = 5
+        self.assertTrue(original.flags.writeable)
+    def test_frequency_cache_evicts_least_recently_used(self):
+        cache = fm.FrequencyCache(40)
+        cache.put('a', 0, np.array([1, 2]))
+        cache.put('b', 0, np.array([1, 2]))
+        cache.get('a')
+        cache.put('c', 0, np.array([1, 2]))
+        self.assertEqual(('a' in cache, 'b' in cache, 'c' in cache),
+                         (True, False, True))
+        self.assertEqual(cache.info()['bytes'], 32)
+    def test_frequency_cache_wont_store_too_big(self):
+        cache = fm.FrequencyCache(10)
+        cache.put('a', 0, np.array([1, 2]))
+        self.assertEqual(len(cache), 0)
+    def test_frequency_cache_put_same_key_replaces(self):
+        cache = fm.FrequencyCache(100)
+        cache.put('a', 0, np.array([1, 2]))
+        cache.put('a', 1, np.array([1, 2, 3]))
+        self.assertEqual(cache.get('a')[0], 1)
+        self.assertEqual(cache.info()['bytes'], 24)
+    def test_frequency_cache_set_max_bytes_trims(self):
+        cache = fm.FrequencyCache(100)
+        cache.put('a', 0, np.array([1, 2]))
+        cache.put('b', 0, np.array([1, 2]))
+        cache.set_max_bytes(20)
+        self.assertEqual(('a' in cache, 'b' in cache), (False, True))
+    def test_frequency_cache_clear(self):
+        cache = fm.FrequencyCache(100)
+        cache.put('a', 0, np.array([1, 2]))
+        cache.get('a')
+        cache.clear()
+        self.assertEqual(cache.info(), {'hits': 0, 'misses': 0, 'entries': 0,
+                                        'bytes': 0, 'max_bytes': 100})
+
+    def test_frequencies_trims_zeros(self):
+        frequencies = fm.Frequencies(-2, np.array([0, 0, 3, 0, 1, 0]))
+        self.assertEqual(frequencies.offset, 0)
+        self.assertEqual(frequencies.array.tolist(), [3, 0, 1])
+    def test_frequencies_empty_raises_error(self):
+        self.assertRaises(ValueError, fm.Frequencies, 0, np.array([0, 0]))
+    def test_frequencies_array_is_read_only(self):
+        original = np.array([1, 2])
+        frequencies = fm.Frequencies(0, original)
+        self.assertRaises(ValueError, frequencies.array.__setitem__, 0, 5)
+        self.assertTrue(original.flags.writeable)
+    def test_frequencies_from_tuple_list_and_back(self):
+        tuple_list = table_tuple_list((dt.Die(6), 3), (dt.ModDie(2, -4), 1))
+        frequencies = fm.Frequencies.from_tuple_list(tuple_list)
+        self.assertEqual(frequencies.tuple_list(), tuple_list)
+        self.assertEqual(list(frequencies), tuple_list)
+        self.assertEqual(len(frequencies), len(tuple_list))
+        self.assertIs(fm.Frequencies.from_tuple_list(frequencies), frequencies)
+    def test_frequencies_info(self):
+        frequencies = fm.Frequencies(-1, np.array([2**70, 0, 3], dtype=object))
+        self.assertEqual(frequencies.values_range(), (-1, 1))
+        self.assertEqual(frequencies.total(), 2**70 + 3)
+        self.assertGreater(frequencies.nbytes, 24)
+    def test_frequencies_equal_to_frequencies(self):
+        first = fm.Frequencies(1, np.array([1, 2], dtype=np.int64))
+        second = fm.Frequencies(1, np.array([1, 2], dtype=object))
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(fm.Frequencies(1, np.array([1, 2]))))
+        self.assertNotEqual(first, fm.Frequencies(2, np.array([1, 2])))
+        self.assertNotEqual(first, fm.Frequencies(1, np.array([1, 2, 1])))
+    def test_frequencies_equal_to_tuple_list(self):
+        frequencies = fm.Frequencies(1, np.array([1, 0, 2]))
+        self.assertTrue(frequencies == [(1, 1), (3, 2)])
+        self.assertTrue([(1, 1), (3, 2)] == frequencies)
+        self.assertTrue(frequencies != [(1, 1), (2, 0), (3, 2)])
+        self.assertFalse(frequencies == 'abc')
+    def test_frequencies_tuple_list_compare_checks_ends_first(self):
+        frequencies = fm.Frequencies(1, np.array([1, 0, 2]))
+        self.assertFalse(frequencies == [(1, 1), (4, 2)])
+        self.assertFalse(frequencies == [(1, 1), (2, 1), (3, 2)])
+        self.assertFalse(frequencies == [])
+        self.assertFalse(frequencies == [1, 2])
+        def load():
+            raise AssertionError('array was loaded')
+        lazy = fm.Frequencies.from_file(5, load)
+        self.assertTrue(lazy != [(0, 1)])
+    def test_frequencies_digest(self):
+        small = fm.Frequencies(1, np.array([1, 2], dtype=np.int64))
+        same = fm.Frequencies(1, np.array([1, 2], dtype=object))
+        self.assertEqual(small.digest(), same.digest())
+        self.assertNotEqual(small.digest(),
+                            fm.Frequencies(0, np.array([1, 2])).digest())
+        big = fm.Frequencies(1, np.array([2**70, 2], dtype=object))
+        self.assertNotEqual(small.digest(), big.digest())
+        self.assertEqual(len(big.digest()), 40)
+    def test_frequencies_pickle(self):
+        frequencies = fm.Frequencies(1, np.array([1, 0, 2]))
+        new = pickle.loads(pickle.dumps(frequencies))
+        self.assertEqual(new, frequencies)
+        self.assertFalse(new.array.flags.writeable)
+
+if __name__ == '__main__':
+    unittest.main()
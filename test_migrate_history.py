@@ -0,0 +1,31 @@
+# pylint: disable=missing-docstring, invalid-name
+'''tests for the migrate_history.py module'''
+from __future__ import absolute_import
+import os
+import unittest
+import dicetables as dt
+import numpy as np
+
+import file_handler as fh
+import migrate_history
+from test_file_handler import create_plot_object
+
+class TestMigrateHistory(unittest.TestCase):
+    def tearDown(self):
+        for file_name in (fh.HISTORY_FILE + '.legacy', 'missing.npy'):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def test_main_migrates_files(self):
+        table = dt.DiceTable()
+        table.add_die(2, dt.Die(4))
+        np.save(fh.HISTORY_FILE, np.array([create_plot_object(table)]))
+        self.assertEqual(migrate_history.main([fh.HISTORY_FILE]), 0)
+        self.assertEqual(fh.read_history_np()[0], 'ok')
+        self.assertEqual(migrate_history.main([]), 0)
+    def test_main_fails_if_a_file_fails(self):
+        self.assertEqual(
+            migrate_history.main([fh.HISTORY_FILE, 'missing.npy']), 1)
+
+if __name__ == '__main__':
+    unittest.main()
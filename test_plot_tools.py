@@ -0,0 +1,108 @@
+# pylint: disable=missing-docstring, invalid-name, too-many-public-methods
+'''tests for the plot_tools.py module'''
+from __future__ import absolute_import
+
+import unittest
+
+import numpy as np
+import dicetables as dt
+import plot_tools as pt
+
+
+class TestPlotTools(unittest.TestCase):
+    def test_downsample_keeps_small_graphs(self):
+        self.assertEqual(pt.downsample([1, 2, 3], [1, 5, 2], 2).tolist(),
+                         [0, 1, 2])
+        self.assertEqual(pt.downsample(range(10), range(10), 10).tolist(),
+                         list(range(10)))
+    def test_downsample_keeps_ends_peak_and_lowest(self):
+        y_vals = np.random.RandomState(0).rand(1000)
+        keep = pt.downsample(range(1000), y_vals, 50)
+        self.assertLessEqual(len(keep), 50)
+        self.assertEqual(keep.tolist(), sorted(set(keep.tolist())))
+        self.assertEqual([keep[0], keep[-1]], [0, 999])
+        self.assertIn(y_vals.argmax(), keep)
+        self.assertIn(y_vals.argmin(), keep)
+    def test_downsample_keeps_min_and_max_of_each_bucket(self):
+        y_vals = [0, 1, 9, 2, 3, 8, 1, 4, 7, 0]
+        keep = pt.downsample(range(10), y_vals, 6)
+        self.assertEqual(keep.tolist(), [0, 1, 2, 5, 6, 9])
+    def test_downsample_pts_axes_and_pts(self):
+        table = dt.DiceTable()
+        table.add_die(100, dt.Die(6))
+        axes = dt.graph_pts(table, axes=True, exact=False)
+        pts = dt.graph_pts(table, axes=False, exact=False)
+        small_axes = pt.downsample_pts(axes, 40, True)
+        self.assertLessEqual(len(small_axes[0]), 40)
+        self.assertEqual((small_axes[0][0], small_axes[0][-1]), (100, 600))
+        self.assertEqual(max(small_axes[1]), max(axes[1]))
+        self.assertEqual(pt.downsample_pts(pts, 40, False).tolist(),
+                         [list(pair) for pair in zip(*small_axes)])
+    def test_downsample_pts_returns_small_or_unlimited_pts_as_they_are(self):
+        pts = [(1, 50.0), (2, 50.0)]
+        self.assertIs(pt.downsample_pts(pts, 10, False), pts)
+        axes = [tuple(range(100)), tuple(range(100))]
+        self.assertIs(pt.downsample_pts(axes, None, True), axes)
+    def test_detail_pyramid_levels_halve_and_keep_peak_and_range(self):
+        y_vals = np.random.RandomState(1).rand(4000)
+        pyramid = pt.DetailPyramid(np.arange(4000), y_vals, min_points=300)
+        sizes = [len(x_vals) for x_vals, _ in pyramid.levels]
+        self.assertEqual(sizes[0], 4000)
+        self.assertLessEqual(sizes[-1], 300)
+        for size, next_size in zip(sizes, sizes[1:]):
+            self.assertLessEqual(next_size, size // 2)
+        for x_vals, level_y in pyramid.levels:
+            self.assertEqual((x_vals[0], x_vals[-1]), (0, 3999))
+            self.assertEqual(level_y.max(), y_vals.max())
+    def test_detail_pyramid_level_for_zoom(self):
+        pyramid = pt.DetailPyramid(np.arange(4000), np.ones(4000),
+                                   min_points=300)
+        self.assertEqual(pyramid.level_for(0, 3999, 4000), 0)
+        self.assertEqual(pyramid.level_for(0, 3999, None), 0)
+        self.assertEqual(pyramid.level_for(0, 3999, 2000), 1)
+        self.assertEqual(pyramid.level_for(0, 3999, 100),
+                         len(pyramid.levels) - 1)
+        self.assertEqual(pyramid.level_for(1000, 1100, 200), 0)
+    def test_detail_pyramid_points_are_exact_on_screen(self):
+        y_vals = np.random.RandomState(2).rand(4000)
+        pyramid = pt.DetailPyramid(np.arange(4000), y_vals, min_points=300)
+        x_vals, new_y = pyramid.points(1000, 1100, 200)
+        self.assertTrue(np.all(np.diff(x_vals) > 0))
+        self.assertEqual((x_vals[0], x_vals[-1]), (0, 3999))
+        on_screen = (x_vals >= 999) & (x_vals <= 1101)
+        self.assertEqual(x_vals[on_screen].tolist(), list(range(999, 1102)))
+        self.assertEqual(new_y[on_screen].tolist(), y_vals[999:1102].tolist())
+        self.assertLess(len(x_vals), 300 + 103)
+    def test_detail_pyramid_rows_hold_every_level(self):
+        pyramid = pt.DetailPyramid(np.arange(1000), np.ones(1000),
+                                   min_points=100)
+        self.assertFalse(pyramid.rows.flags.writeable)
+        self.assertEqual(pyramid.bounds[-1], len(pyramid.rows))
+        self.assertEqual([len(x_vals) for x_vals, _ in pyramid.levels],
+                         [stop - start for start, stop
+                          in zip(pyramid.bounds, pyramid.bounds[1:])])
+    def test_detail_pyramid_ranges(self):
+        y_vals = np.random.RandomState(3).rand(4000)
+        pyramid = pt.DetailPyramid(np.arange(5, 4005), y_vals,
+                                   min_points=300)
+        self.assertEqual(pyramid.ranges(),
+                         ((5, 4004), (y_vals.min(), y_vals.max())))
+    def test_pyramid_cache_throws_out_least_recently_used(self):
+        pyramids = [pt.DetailPyramid(np.arange(100), np.ones(100))
+                    for _ in range(3)]
+        cache = pt.PyramidCache(2 * pyramids[0].rows.nbytes)
+        cache.put('a', pyramids[0])
+        cache.put('b', pyramids[1])
+        self.assertIs(cache.get('a'), pyramids[0])
+        cache.put('c', pyramids[2])
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.info(),
+                         {'hits': 1, 'misses': 1, 'entries': 2,
+                          'bytes': 2 * pyramids[0].rows.nbytes,
+                          'max_bytes': 2 * pyramids[0].rows.nbytes})
+        cache.set_max_bytes(0)
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()